@@ -8,4 +8,9 @@ class BaseAgent(ABC):
     def run(self, task: str) -> Dict[str, Any]:
         """Run the agent on a task."""
         pass
+
+    @abstractmethod
+    def reset(self):
+        """Clear the state of the previous task."""
+        pass
     
@@ -1,14 +1,16 @@
 from typing import Dict, Any
 import os
 import json
-from langchain_ollama import ChatOllama
-from langchain_aws import ChatBedrock
-from langchain_openai import AzureChatOpenAI, ChatOpenAI
 from utils.output_parser import CoTOutputParser, extract_python_code
 from utils.code_execution import CustomPythonAstREPLTool
+from utils.model_registry import get_chat_model
+from utils.metrics import timer
+from utils.tracing import traced
+from utils.streaming import call_llm, code_block_end
 from utils.data_class import DataSample
 from utils.prepare_prompt import prepare_prompt
 from .prompt_template import cot_template, CoTPromptTemplate
+from .prompt_builder import PromptBuilder, context_budget
 from .base_agent import BaseAgent
 
 
@@ -41,6 +43,7 @@ class ChainOfThoughtAgent(BaseAgent):
             template=cot_template, 
             tools=[self.python_repl], 
             input_variables=["file_paths", "descriptions", "question"])
+        self.prompt_builder = PromptBuilder(self.prompt)
         self.history = []
     
     def _load_config(self, path: str, config_name: str) -> dict:
@@ -67,32 +70,37 @@ class ChainOfThoughtAgent(BaseAgent):
         Returns:
             object: The initialized language model.
         """
-        if self.model_type == 'deepseek':
-            return ChatOllama(model=self.model_name, base_url=self.api_key, temperature=temperature, num_ctx=8196*2, num_predict=6000)
-        elif self.model_type == 'meta':
-            return ChatOllama(model=self.model_name, base_url=self.api_key, temperature=temperature, repetition_penalty=1.18, num_ctx=8192, num_predict=2048)
-        elif self.model_type == 'anthropic':
-            return ChatBedrock(model_id=self.model_name, model_kwargs=dict(temperature=temperature), region_name='us-east-1', max_tokens=2048)
-        elif self.model_type == 'openai':
-            return AzureChatOpenAI(azure_deployment=self.model_name, api_version="2024-10-01-preview", temperature=temperature, max_tokens=2048)
-        elif self.model_type == 'openai-o':
-            return AzureChatOpenAI(azure_deployment='o3-mini-2025-01-31', api_version="2024-12-01-preview", temperature=1, reasoning_effort='low', max_completion_tokens=4000)
-        else:
-            raise ValueError(f"Unsupported model type: {self.model_type}")
+        # The CoT experiments with llama-3.3 used a context of 8192 tokens
+        overrides = {'num_ctx': 8192} if self.model_type == 'meta' else {}
+        return get_chat_model(self.model_type, self.model_name, base_url=self.api_key, temperature=temperature, **overrides)
 
+    def reset(self):
+        """Clear the per-sample state so that the agent, its model client and parsers can be reused."""
+        self.history = []
+        self.python_repl.max_turns = 0
+
+    @traced('ChainOfThoughtAgent.run')
     def run(self, sample: DataSample, agent_instruction: str = "\nLet's think step by step.", max_steps: int = 2, deepseek=False) -> Dict[str, Any]:
         change_dir = os.path.dirname(sample.file_paths[0])
-        current_input = prepare_prompt(sample)
+        with timer('prepare_prompt'):
+            current_input = prepare_prompt(sample)
         current_input.update({"agent_instruction": agent_instruction})
         if 'conversation' not in current_input:
             current_input['conversation'] = []
         steps_taken = 0
 
         while steps_taken < max_steps:
-            prompt_result = self.prompt.format(**current_input).strip()
-            llm_output = self.llm.invoke([('human', prompt_result)])
+            with timer('prompt_format'):
+                prompt_result = self.prompt_builder.format(context_budget(self.llm), **current_input).strip()
+            with timer('llm_call') as call:
+                # A final answer only ends the run after the first step, so only the first
+                # completion can be stopped at its code block
+                llm_output, call['ttft'] = call_llm(
+                    self.llm, [('human', prompt_result)], stop_at=code_block_end if steps_taken == 0 else None)
+                call['usage_metadata'] = llm_output.usage_metadata
             try:
-                parsed_output = self.parser.parse(llm_output.content)
+                with timer('parse'):
+                    parsed_output = self.parser.parse(llm_output.content)
             except Exception as e:
                 return self._format_result()
 
@@ -112,7 +120,8 @@ class ChainOfThoughtAgent(BaseAgent):
             workflow = parsed_output.get('workflow')
             if action != self.python_repl.name or not action_input:
                 raise ValueError(f"Invalid action or action_input: action={action}, action_input={action_input}")
-            observation = self.python_repl._run(extract_python_code(action_input), change_dir=change_dir)
+            with timer('exec'):
+                observation = self.python_repl._run(extract_python_code(action_input), change_dir=change_dir)
             self.history[-1].update({'observation': observation})
             current_input['conversation'].append((action, action_input, workflow, observation))
             steps_taken += 1
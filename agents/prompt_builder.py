@@ -0,0 +1,160 @@
+from typing import Dict, List
+from utils.time_print import time_print
+from .prompt_template import tool_variables
+
+PROMPT_BUDGET_POLICIES = ('none', 'trim_observations', 'drop_turns')
+# Characters kept of an observation trimmed to fit the budget
+MIN_OBSERVATION_CHARS = 200
+
+_policy = 'none'
+_max_tokens = None
+_encoding = None
+
+
+def configure_prompt_budget(policy: str = 'none', max_tokens: int = None):
+    """
+    Set how prompts exceeding the context budget of the model are handled.
+
+    Args:
+        policy (str): 'none' sends prompts as they are, 'trim_observations' shortens the
+            observations of the oldest turns first, and 'drop_turns' leaves out the oldest
+            turns (keeping the last one) before trimming observations.
+        max_tokens (int): Prompt budget of every model, or None to use the context size
+            minus the completion size of models that declare one (`num_ctx`, `num_predict`).
+    """
+    global _policy, _max_tokens
+    if policy not in PROMPT_BUDGET_POLICIES:
+        raise ValueError(f"Unsupported prompt budget policy: {policy}")
+    _policy = policy
+    _max_tokens = max_tokens
+
+
+def count_tokens(text: str) -> int:
+    """Count the tokens of `text` with tiktoken, or estimate them at four characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            # tiktoken is not installed or cannot load its encoding offline
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def context_budget(llm):
+    """Prompt tokens available with `llm`, or None if unknown."""
+    if _max_tokens:
+        return _max_tokens
+    num_ctx = getattr(llm, 'num_ctx', None)
+    if not num_ctx:
+        return None
+    return num_ctx - (getattr(llm, 'num_predict', None) or 0)
+
+
+def _trim(text: str, keep: int) -> str:
+    """Keep the first and last `keep // 2` characters of `text`."""
+    if len(text) <= keep:
+        return text
+    head, tail = keep // 2, keep - keep // 2
+    return f"{text[:head]}\n... [{len(text) - keep} characters trimmed] ...\n{text[len(text) - tail:]}"
+
+
+class PromptBuilder:
+    """
+    Incremental renderer of the prompt of an agent.
+
+    The template is split at `{conversation}`. The part before it depends only on the sample
+    and is rendered and counted once per sample. Conversation turns are rendered and counted
+    when they are appended, so a step only formats its new turn. Within the budget the prompt
+    is identical to `prompt.format(**kwargs)`.
+
+    Args:
+        prompt: A `CoTPromptTemplate`, `ReflexionPromptTemplate` or `ReActPromptTemplate`.
+        prefix (str): The template before `{conversation}`.
+        suffix (str): The template after `{conversation}`.
+    """
+    def __init__(self, prompt):
+        self.prompt = prompt
+        self.prefix, self.suffix = prompt.template.split('{conversation}', 1)
+        self._prefix_key = None
+        self._prefix = None
+        self._prefix_tokens = None
+        # (turn, rendered turn, tokens or None until counted)
+        self._turns = []
+
+    def _render_prefix(self, variables: Dict) -> str:
+        key = tuple(sorted(variables.items()))
+        if key != self._prefix_key:
+            self._prefix_key = key
+            self._prefix = self.prefix.format(**variables, **tool_variables(self.prompt.tools))
+            self._prefix_tokens = None
+            self._turns = []
+        return self._prefix
+
+    def _render_turns(self, conversation: List) -> List:
+        """Render the turns not rendered yet; a conversation that was not appended to starts over."""
+        if len(conversation) < len(self._turns) or any(
+                turn is not rendered[0] and turn != rendered[0] for turn, rendered in zip(conversation, self._turns)):
+            self._turns = []
+        for turn in conversation[len(self._turns):]:
+            self._turns.append((turn, self.prompt.format_turn(*turn), None))
+        return self._turns
+
+    def format(self, budget: int = None, **kwargs) -> str:
+        """
+        Format the prompt, applying the configured policy if it exceeds `budget` tokens.
+
+        Args:
+            budget (int): Prompt tokens available, e.g. from `context_budget(llm)`.
+            **kwargs: Input values of the template, including the `conversation`.
+
+        Returns:
+            str: The formatted prompt.
+        """
+        conversation = kwargs.pop("conversation")
+        suffix_variables = {name: kwargs.pop(name) for name in list(kwargs) if '{' + name + '}' in self.suffix}
+        prefix = self._render_prefix(kwargs)
+        suffix = self.suffix.format(**suffix_variables)
+        visible = len(self.prompt.visible_turns(conversation))
+        turns = self._render_turns(conversation)[len(conversation) - visible:]
+        thoughts = [rendered for _, rendered, _ in turns]
+
+        if _policy != 'none' and budget:
+            thoughts = self._fit(budget, prefix, suffix, turns)
+        return prefix + "".join(thoughts) + suffix
+
+    def _fit(self, budget: int, prefix: str, suffix: str, turns: List) -> List:
+        """The rendered turns, shortened by the configured policy until the prompt fits `budget`."""
+        if self._prefix_tokens is None:
+            self._prefix_tokens = count_tokens(prefix)
+        for index, (turn, rendered, tokens) in enumerate(self._turns):
+            if tokens is None:
+                self._turns[index] = (turn, rendered, count_tokens(rendered))
+        turns = self._turns[len(self._turns) - len(turns):]
+        total = self._prefix_tokens + count_tokens(suffix) + sum(tokens for _, _, tokens in turns)
+        if total <= budget:
+            return [rendered for _, rendered, _ in turns]
+
+        thoughts = [[turn, rendered, tokens] for turn, rendered, tokens in turns]
+        if _policy == 'drop_turns':
+            while len(thoughts) > 1 and total > budget:
+                total -= thoughts.pop(0)[2]
+        # Shorten observations, oldest first, in proportion to the tokens over budget
+        for thought in thoughts:
+            action, action_input, workflow, observation = thought[0]
+            keep = len(observation or '')
+            while total > budget and keep > MIN_OBSERVATION_CHARS:
+                keep = max(MIN_OBSERVATION_CHARS, int(keep * (1 - (total - budget) / max(thought[2], 1))) - 64)
+                rendered = self.prompt.format_turn(action, action_input, workflow, _trim(observation, keep))
+                tokens = count_tokens(rendered)
+                total += tokens - thought[2]
+                thought[1:] = [rendered, tokens]
+        time_print(f'Prompt exceeded the budget of {budget} tokens; {_policy} reduced it to {total} tokens.')
+        return [rendered for _, rendered, _ in thoughts]
+
+
+if __name__ == '__main__':
+    pass
@@ -3,6 +3,14 @@ from langchain.tools import BaseTool
 from typing import List, Dict
 from pydantic import Field
 
+
+def tool_variables(tools: List[BaseTool]) -> Dict[str, str]:
+    """Render the `tool_description` and `tool_names` variables of the templates."""
+    return {
+        "tool_description": "\n".join([f"{tool.name}: {tool.description}" for tool in tools]),
+        "tool_names": ", ".join([tool.name for tool in tools]),
+    }
+
 ####################### Chain of Thought
 cot_template = """You are a statistician trying to answer a question based on one or more datasets.
 
@@ -52,16 +60,20 @@ class CoTPromptTemplate(StringPromptTemplate):
         """
         # Get the conversation (action, action input, observation tuples)
         conversation = kwargs.pop("conversation")
-        thoughts = ""
-        for action, action_input, workflow, observation in conversation[-1:]:
-            thoughts += f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\nObservation: {observation}"
+        thoughts = "".join(self.format_turn(*turn) for turn in self.visible_turns(conversation))
         # Set the conversation variable to that value
         kwargs["conversation"] = thoughts
 
-        kwargs["tool_description"] = "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools])
-        kwargs["tool_names"] = ", ".join([tool.name for tool in self.tools])
+        kwargs.update(tool_variables(self.tools))
         return self.template.format(**kwargs)
 
+    def visible_turns(self, conversation: List) -> List:
+        """Only the last turn is shown."""
+        return conversation[-1:]
+
+    def format_turn(self, action, action_input, workflow, observation) -> str:
+        return f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\nObservation: {observation}"
+
 ####################### Reflexion (reproducibility)
 reflexion_template = """You are a statistician trying to answer a question based on one or more datasets.
 
@@ -111,18 +123,23 @@ class ReflexionPromptTemplate(StringPromptTemplate):
         """
         # Get the conversation (action, action input, observation tuples)
         conversation = kwargs.pop("conversation")
-        thoughts = ""
-        for action, action_input, workflow, observation in conversation[-1:]:
-            thoughts += f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\n"
-            if observation:
-                thoughts += f"Observation: {observation}"
+        thoughts = "".join(self.format_turn(*turn) for turn in self.visible_turns(conversation))
         # Set the conversation variable to that value
         kwargs["conversation"] = thoughts
 
-        kwargs["tool_description"] = "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools])
-        kwargs["tool_names"] = ", ".join([tool.name for tool in self.tools])
+        kwargs.update(tool_variables(self.tools))
         return self.template.format(**kwargs)
 
+    def visible_turns(self, conversation: List) -> List:
+        """Only the last turn is shown."""
+        return conversation[-1:]
+
+    def format_turn(self, action, action_input, workflow, observation) -> str:
+        thoughts = f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\n"
+        if observation:
+            thoughts += f"Observation: {observation}"
+        return thoughts
+
 ####################### ReAct
 react_template = """You are a statistician trying to answer a question based on one or more datasets.
 
@@ -214,15 +231,19 @@ class ReActPromptTemplate(StringPromptTemplate):
             str: The formatted prompt.
         """
         conversation = kwargs.pop("conversation")
-        thoughts = ""
-        for action, action_input, workflow, observation in conversation:
-            thoughts += f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\n<Environment>\nObservation: {observation}\n<Agent>\n"
+        thoughts = "".join(self.format_turn(*turn) for turn in self.visible_turns(conversation))
         # Set the conversation variable to that value
         kwargs["conversation"] = thoughts
 
-        kwargs["tool_description"] = "\n".join([f"{tool.name}: {tool.description}" for tool in self.tools])
-        kwargs["tool_names"] = ", ".join([tool.name for tool in self.tools])
+        kwargs.update(tool_variables(self.tools))
         return self.template.format(**kwargs)
 
+    def visible_turns(self, conversation: List) -> List:
+        """Every turn is shown."""
+        return conversation
+
+    def format_turn(self, action, action_input, workflow, observation) -> str:
+        return f"Workflow: {workflow}\n\nAction: {action}\nAction input: \n{action_input}\n\n<Environment>\nObservation: {observation}\n<Agent>\n"
+
 if __name__ == '__main__':
     pass
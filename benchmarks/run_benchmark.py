@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import resource
+import threading
+import multiprocessing
+import warnings
+import click
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from utils.load_data import load_datasets
+from utils.time_print import time_print
+from utils.sandbox import configure_sandbox, shutdown_sandbox
+from utils.dataframe_cache import configure_dataframe_cache
+from utils.model_registry import set_chat_model_factory
+from utils.metrics import configure_metrics, get_metrics
+from utils.output_parser import extract_python_code
+from utils.replay_llm import LatencyModel, ReplayChatModel, ScriptedJudgeModel
+from experiments.get_agent import get_agent_type
+from experiments.run_experiment import run_sample
+from eval.reproducibility import Reproducibility
+from eval.run_reproducibility import evaluate_sample
+
+warnings.filterwarnings("ignore")
+
+
+def _memory_report() -> dict:
+    """
+    Peak resident memory in MB of this process and of its largest sandbox worker.
+
+    Both are process-wide peaks (ru_maxrss is in KB on Linux). Every phase of the benchmark runs
+    in its own process, so they cover that phase only. The sandbox is shut down first, because
+    workers only count towards RUSAGE_CHILDREN once they have exited.
+    """
+    shutdown_sandbox()
+    return {
+        "process_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _report(num_samples: int, seconds: float) -> dict:
+    summary = get_metrics().summary()
+    return {
+        "samples": num_samples,
+        "seconds": seconds,
+        "samples_per_second": num_samples / max(seconds, 1e-9),
+        "stages": {
+            stage: {
+                "total_seconds": stats["total_seconds"],
+                "p50": stats["seconds"]["p50"],
+                "p95": stats["seconds"]["p95"],
+            }
+            for stage, stats in summary["stages"].items()
+        },
+        **_memory_report(),
+    }
+
+
+def _in_subprocess(func, *args):
+    """Run `func(*args)` in a fresh process, so that its memory peak is measured on its own."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def _setup(dataset_name: str, options: dict):
+    """
+    Configure a benchmark process and load its dataset.
+
+    No provider client is created: agents are answered by the replay models and the evaluator
+    by the scripted judge.
+
+    Returns:
+        tuple: The dataset, the latency model (or None) and the judge.
+    """
+    warnings.filterwarnings("ignore")
+    configure_dataframe_cache(options["dataframe_cache_mb"])
+    configure_sandbox(options["sandbox_workers"], dataframe_cache_mb=options["dataframe_cache_mb"])
+    latency = LatencyModel.from_metrics(options["latency_metrics"]) if options["latency_metrics"] else None
+    judge = ScriptedJudgeModel(latency=latency)
+    set_chat_model_factory(lambda model_type, model_name: judge)
+    dataset = load_datasets(names=[dataset_name]).get_dataset(dataset_name)
+    return dataset, latency, judge
+
+
+def benchmark_experiment(dataset_name, recorded, agent_type, model_name, parent_dir, concurrency, options):
+    """
+    Replay the recorded LLM outputs of an experiment through `run_sample`.
+
+    Args:
+        dataset_name (str): Name of the dataset of the experiment.
+        recorded (dict): Recorded results of the replayed samples, keyed by sample index.
+        agent_type (str): Type of the agent, e.g. 'COT'.
+        model_name (str): Name of the recorded model.
+        parent_dir (str): Repository root containing the `config` folder.
+        concurrency (int): Number of samples replayed at once.
+        options (dict): `sandbox_workers`, `dataframe_cache_mb` and `latency_metrics` of the run.
+
+    Returns:
+        tuple: The replayed results and the benchmark report.
+    """
+    dataset, latency, _ = _setup(dataset_name, options)
+    agent_type_enum = get_agent_type(agent_type)
+    def replay(idx):
+        return run_sample(
+            dataset.get_sample(int(idx)), agent_type_enum, model_name, parent_dir,
+            index=int(idx), llm=ReplayChatModel(recorded[idx]['steps'], latency)
+        )
+
+    configure_metrics(None, labels={"model": model_name, "agent_type": agent_type, "stage": "experiment"})
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        replayed = dict(zip(recorded, executor.map(replay, recorded)))
+    return replayed, _report(len(replayed), time.perf_counter() - start)
+
+
+def benchmark_evaluation(dataset_name, results, agent_type, model_name, concurrency, options):
+    """
+    Evaluate accuracy and reproducibility of replayed results with the scripted judge.
+
+    Args:
+        dataset_name (str): Name of the dataset of the experiment.
+        results (dict): Results of the evaluated samples, keyed by sample index.
+        agent_type (str): Type of the agent, e.g. 'COT'.
+        model_name (str): Name of the evaluated model.
+        concurrency (int): Number of samples evaluated at once.
+        options (dict): `sandbox_workers`, `dataframe_cache_mb` and `latency_metrics` of the run.
+
+    Returns:
+        dict: The benchmark report.
+    """
+    dataset, _, judge = _setup(dataset_name, options)
+    judge.codes_by_question.update({
+        dataset.get_sample(int(idx)).question: next(
+            (extract_python_code(step['action_input']) for step in result['steps'] if step['action_input']), '')
+        for idx, result in results.items()
+    })
+    evaluators = threading.local()
+    def evaluate(idx):
+        if not hasattr(evaluators, 'evaluator'):
+            evaluators.evaluator = Reproducibility()
+        return evaluate_sample(evaluators.evaluator, dataset.get_sample(int(idx)), results[idx], {},
+                               model_name, agent_type, accuracy=True, reproducibility=True)
+
+    configure_metrics(None, labels={"model": model_name, "agent_type": agent_type, "stage": "evaluation"})
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        evaluated = list(executor.map(evaluate, results))
+    return _report(len(evaluated), time.perf_counter() - start)
+
+
+@click.command()
+@click.option('--dataset_name', required=True, help='Name of the dataset whose recorded results are replayed.')
+@click.option('--model_name', required=True, help='Name of the model whose recorded results are replayed.')
+@click.option('--agent_types', default='COT,ROT,REACT,REFLEXION', show_default=True, help='Comma-separated agent types to benchmark.')
+@click.option('--num_samples', default=None, type=int, help='Number of recorded samples replayed per agent type (all by default).')
+@click.option('--concurrency', default=1, show_default=True, type=click.IntRange(min=1), help='Number of samples run at once.')
+@click.option('--latency_metrics', default=None, help='Metrics JSON of a recorded run whose llm_call latency is injected into every replayed call.')
+@click.option('--evaluate', is_flag=True, help='Flag to also benchmark the accuracy and reproducibility evaluation with a scripted judge.')
+@click.option('--sandbox_workers', default=0, show_default=True, type=click.IntRange(min=0), help='Number of worker processes executing generated code (0 executes in-process).')
+@click.option('--dataframe_cache_mb', default=None, type=float, help='Size in MB of the cache of DataFrames loaded by generated code (disabled by default).')
+def main(dataset_name, model_name, agent_types, num_samples, concurrency, latency_metrics, evaluate, sandbox_workers, dataframe_cache_mb):
+    parent_dir = os.path.abspath("")
+    options = {"sandbox_workers": sandbox_workers, "dataframe_cache_mb": dataframe_cache_mb, "latency_metrics": latency_metrics}
+
+    reports = {}
+    for agent_type in agent_types.split(','):
+        results_path = os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}.json')
+        if not os.path.exists(results_path):
+            time_print(f'Skipping {agent_type}: {results_path} not found.')
+            continue
+        with open(results_path, 'r') as f:
+            recorded = {idx: result for idx, result in json.load(f).items() if 'steps' in result}
+        recorded = dict(list(recorded.items())[:num_samples])
+
+        # Each phase runs in its own process, so its memory peaks do not include earlier phases
+        replayed, report = _in_subprocess(
+            benchmark_experiment, dataset_name, recorded, agent_type, model_name, parent_dir, concurrency, options)
+        reports[agent_type] = {"experiment": report}
+        time_print(f'{agent_type} experiment: {report["samples_per_second"]:.2f} samples/s, '
+                   f'process peak RSS {report["process_peak_rss_mb"]:.0f} MB, worker peak RSS {report["worker_peak_rss_mb"]:.0f} MB')
+
+        if evaluate:
+            report = _in_subprocess(benchmark_evaluation, dataset_name, replayed, agent_type, model_name, concurrency, options)
+            reports[agent_type]["evaluation"] = report
+            time_print(f'{agent_type} evaluation: {report["samples_per_second"]:.2f} samples/s, '
+                       f'process peak RSS {report["process_peak_rss_mb"]:.0f} MB, worker peak RSS {report["worker_peak_rss_mb"]:.0f} MB')
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_path = os.path.join(parent_dir, 'results', f'benchmark_{model_name}_{dataset_name}_{timestamp}.json')
+    with open(output_path, 'w') as f:
+        json.dump({
+            "dataset": dataset_name,
+            "model": model_name,
+            "concurrency": concurrency,
+            "sandbox_workers": sandbox_workers,
+            "latency_metrics": latency_metrics,
+            "reports": reports,
+        }, f, indent=4)
+    time_print(f'Benchmark saved to {output_path}')
+
+
+if __name__ == '__main__':
+    main()
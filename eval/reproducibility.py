@@ -1,15 +1,28 @@
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import contextvars
+import threading
 import openai
 import os
 import re
 from .eval_prompt import accuracy_prompt, workflow_to_code_prompt, llm_reproducibility_prompt
 from utils.output_parser import ScoreParser, extract_python_code
-from langchain_openai import AzureChatOpenAI
 from utils.code_execution import CustomPythonAstREPLTool
+from utils.model_registry import get_chat_model
+from utils.metrics import timer
+from utils.tracing import span, traced
 
 class Reproducibility:
-    def __init__(self):
-        self.llm = AzureChatOpenAI(azure_deployment='gpt-4o-2024-11-20', api_version="2024-10-01-preview", temperature=0)
+    def __init__(self, execution_cache=None, speculative_conversion=False):
+        self.execution_cache = execution_cache
+        # Thread converting the workflow while the caller executes the original code. Concurrent
+        # samples use their own evaluators, so the threads scale with the number of concurrent samples.
+        self.stage_executor = None
+        if speculative_conversion:
+            self.stage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reproducibility')
+        self.llm = get_chat_model('openai', 'gpt-4o-2024-11-20', temperature=0, max_tokens=None)
         self.parser = ScoreParser()
         self.original_workflows = []
         self.converted_workflows = []
@@ -18,10 +31,19 @@ class Reproducibility:
         self.human_prompts = []
         self.input_tokens = 0
         self.output_tokens = 0
+        self._tokens_lock = threading.Lock()
 
     def add_up_tokens(self, response):
-        self.input_tokens += response.usage_metadata['input_tokens']
-        self.output_tokens += response.usage_metadata['output_tokens']
+        with self._tokens_lock:
+            self.input_tokens += response.usage_metadata['input_tokens']
+            self.output_tokens += response.usage_metadata['output_tokens']
+
+    def _judge(self, stage: str, messages):
+        with timer(stage) as call:
+            response = self.llm.invoke(messages)
+            call['usage_metadata'] = response.usage_metadata
+        self.add_up_tokens(response)
+        return response
 
     def accuracy(self, question, predicted_answer, true_answer, dataset_specific_prompt=''):
         human_prompt = accuracy_prompt.format(
@@ -34,9 +56,8 @@ class Reproducibility:
                 ("system", "You are a data scientist grading the accuracy of a predicted answer to a question."),
                 ("human", human_prompt),
                 ]
-            response = self.llm.invoke(messages)
+            response = self._judge('judge_accuracy', messages)
             #print(response.content)
-            self.add_up_tokens(response)
             score = self.parser.extract_accuracy_score(response.content)
             return score
         except openai.BadRequestError as e:
@@ -44,6 +65,11 @@ class Reproducibility:
             return 1
 
     def workflow_to_code(self, question: str, datasets: List, workflow: str):
+        extracted_code = self._convert_workflow(question, datasets, workflow)
+        self.converted_codes.append(extracted_code)
+        return extracted_code
+
+    def _convert_workflow(self, question: str, datasets: List, workflow: str):
         human_prompt = workflow_to_code_prompt.format(
             question=question,
             datasets=datasets,
@@ -54,57 +80,102 @@ class Reproducibility:
             ("system", "You are a data scientist translating a workflow into code."),
             ("human", human_prompt),
             ]
-        response = self.llm.invoke(messages)
-        self.add_up_tokens(response)
-        extracted_code = extract_python_code(response.content)
-        self.converted_codes.append(extracted_code)
-        return extracted_code
+        response = self._judge('judge_workflow_to_code', messages)
+        return extract_python_code(response.content)
 
     def generate_conclusion(self, question: str, code: str, code_output: str):
         messages = [
             ("system", "You are a data scientist answering a question based on the code and code output."),
             ("human", f"Question: {question}\n\nCode:\n{code}\n\nCode output: {code_output}\n\nPlease generate the answer based only on the code output in this format: \n'Thought:\n\nConclusion:'"),
             ]
-        response = self.llm.invoke(messages)
-        self.add_up_tokens(response)
+        response = self._judge('judge_conclusion', messages)
         pattern = re.compile(r'Conclusion:\s*(.*)', re.DOTALL)
         match = pattern.search(response.content)
         if match:
             return match.group(1).strip()  # Remove any trailing/leading spaces/newlines
         return response.content
 
+    def _execute(self, code: str, change_dir: str, file_paths: List):
+        if self.execution_cache is not None:
+            code_output = self.execution_cache.get(code, file_paths)
+            if code_output is not None:
+                return code_output
+        with timer('exec'):
+            code_output = CustomPythonAstREPLTool()._run(code, change_dir=change_dir)
+        if code_output.find('You cannot generate code anymore.') != -1:
+            code_output = code_output[:code_output.find('You cannot generate code anymore.')]
+        if self.execution_cache is not None:
+            self.execution_cache.put(code, file_paths, code_output)
+        return code_output
+
+    @staticmethod
+    def _run_stage(name: str, func, *args):
+        with span(name):
+            return func(*args)
+
+    def _submit(self, name: str, func, *args):
+        # Stages run in the context of the caller, so their spans belong to its sample
+        return self.stage_executor.submit(contextvars.copy_context().run, self._run_stage, name, func, *args)
+
+    @staticmethod
+    def _settle(future):
+        """Cancel a stage that has not started, or wait for a running one and discard its result."""
+        if future is not None and not future.cancel():
+            with contextlib.suppress(Exception):
+                future.result()
+
+    @traced('Reproducibility.llm_reproducibility')
     def llm_reproducibility(self, sample, code: str, workflow: str, final_answer: str=''):
+        """
+        Judge whether the code converted from the workflow reaches the same conclusion as the original code.
+
+        The workflow is only converted into code once the original code ran without error. With
+        `speculative_conversion`, the conversion runs while the original code is executed, which hides its
+        latency but is paid for even when the original code fails; it is then awaited so that its tokens are
+        counted for this sample. It is not started when the execution cache already holds the output of the
+        original code for the same data, as there is no execution to overlap.
+
+        Args:
+            sample (DataSample): The sample whose data files the code reads.
+            code (str): The original code.
+            workflow (str): The workflow describing the code.
+            final_answer (str): The conclusion drawn from the original code.
+
+        Returns:
+            tuple: The reproducibility score and the reason, or (-1, 'Code not run').
+        """
         change_dir = os.path.dirname(sample.file_paths[0])
         self.original_codes.append(code)
-        if extract_python_code(code):
-            code_1 = extract_python_code(code)
-        else:
-            code_1 = code
-        code_1_output = CustomPythonAstREPLTool()._run(code_1, change_dir=change_dir)
+        code_1 = extract_python_code(code) or code
+        question = sample.question
+        datasets = [os.path.basename(file_path) for file_path in sample.file_paths]
+        code_2_future = None
+        if self.stage_executor is not None and (
+                self.execution_cache is None or self.execution_cache.get(code_1, sample.file_paths) is None):
+            code_2_future = self._submit('workflow_to_code', self._convert_workflow, question, datasets, workflow)
+
+        try:
+            code_1_output = self._run_stage('code_1_exec', self._execute, code_1, change_dir, sample.file_paths)
+        except BaseException:
+            self._settle(code_2_future)
+            raise
         if 'Error [' in code_1_output:
+            self._settle(code_2_future)
             self.human_prompts.append("")
             self.converted_codes.append("")
             return -1, 'Code not run'
-        if code_1_output.find('You cannot generate code anymore.') != -1:
-            code_1_output = code_1_output[:code_1_output.find('You cannot generate code anymore.')]
-        question = sample.question
         # code_1_conclusion = self.generate_conclusion(question=question, code=code_1, code_output=code_1_output)
         code_1_conclusion = final_answer
 
-        code_2 = self.workflow_to_code(
-            question=question,
-            datasets=[os.path.basename(file_path) for file_path in sample.file_paths],
-            workflow=workflow
-        )
-        if extract_python_code(code_2):
-            code_2 = extract_python_code(code_2)
+        if code_2_future is None:
+            code_2 = self._run_stage('workflow_to_code', self._convert_workflow, question, datasets, workflow)
         else:
-            code_2 = code_2
-        code_2_output = CustomPythonAstREPLTool()._run(code_2, change_dir=change_dir)
-        if code_2_output.find('You cannot generate code anymore.') != -1:
-            code_2_output = code_2_output[:code_2_output.find('You cannot generate code anymore.')]
-        code_2_conclusion = self.generate_conclusion(question=question, code=code_2, code_output=code_2_output)
-        
+            code_2 = code_2_future.result()
+        self.converted_codes.append(code_2)
+        code_2 = extract_python_code(code_2) or code_2
+        code_2_output = self._run_stage('code_2_exec', self._execute, code_2, change_dir, sample.file_paths)
+        code_2_conclusion = self._run_stage('conclusion', self.generate_conclusion, question, code_2, code_2_output)
+
         human_prompt = llm_reproducibility_prompt.format(
             question = question,
             code_1 = code_1,
@@ -119,7 +190,10 @@ class Reproducibility:
             #("system", "You are a data scientist analyzing the functional similarity between code chunks."),
             ("human", human_prompt),
             ]
-        response = self.llm.invoke(messages)
-        self.add_up_tokens(response)
+        response = self._run_stage('judge', self._judge, 'judge_reproducibility', messages)
         score, reason = self.parser.extract_similarity_score_and_category(response.content)
         return score, reason
+
+    async def allm_reproducibility(self, sample, code: str, workflow: str, final_answer: str=''):
+        """Asynchronous `llm_reproducibility`, run in a worker thread so that it does not block the event loop."""
+        return await asyncio.to_thread(self.llm_reproducibility, sample, code, workflow, final_answer)
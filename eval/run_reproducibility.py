@@ -1,10 +1,22 @@
 import os
 import numpy as np
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
 from datetime import datetime
 from utils.load_data import load_datasets
 from utils.time_print import time_print
+from utils.sandbox import configure_sandbox
+from utils.llm_cache import configure_llm_cache
+from utils.model_registry import configure_http_pool
+from utils.rate_limiter import configure_rate_limits
+from utils.metrics import configure_metrics, finish_metrics, get_metrics, timer
+from utils.tracing import configure_tracing, finish_tracing, trace_sample
+from utils.dataframe_cache import configure_dataframe_cache
+from utils.output_capture import configure_output_capture
+from utils.results_store import ResultsStore
+from utils.execution_cache import ExecutionCache
 from utils.output_parser import extract_python_code
 from utils.sample_StatQA import sample_StatQA
 from utils.get_CoT_irreproducible_idx import get_irreproducible_idx
@@ -20,6 +32,94 @@ def get_accuracy_by_reproducibility(accuracy_scores, reproducibility_scores):
     accuracy_scores_1, accuracy_scores_0 = accuracy_scores[reproducibility_scores==1], accuracy_scores[reproducibility_scores==0]
     return len(accuracy_scores_1), len(accuracy_scores_0), np.mean(accuracy_scores_1), np.mean(accuracy_scores_0)
 
+def evaluate_sample(evaluator, sample, result, record, model_name, agent_type, accuracy, reproducibility):
+    """
+    Score one sample with the metrics not yet in its checkpoint record.
+
+    Args:
+        evaluator (Reproducibility): Evaluator used only by the calling thread.
+        sample (DataSample): The sample.
+        result (dict): The experiment result of the sample.
+        record (dict): The checkpoint record of the sample, updated in place.
+        model_name (str): Name of the evaluated model.
+        agent_type (str): Type of the evaluated agent.
+        accuracy (bool): Whether to compute the accuracy score.
+        reproducibility (bool): Whether to compute the reproducibility score.
+
+    Returns:
+        tuple: The record and whether any new score was computed.
+    """
+    evaluated_accuracy = not accuracy or 'accuracy_score' in record
+    evaluated_reproducibility = not reproducibility or 'reproducibility_score' in record
+    if evaluated_accuracy and evaluated_reproducibility:
+        return record, False
+    tokens_before = (evaluator.input_tokens, evaluator.output_tokens)
+
+    if agent_type == 'REACT' or agent_type == 'REFLEXION':
+        action_input = next(
+            (step['action_input'] for step in result['steps'][::-1] if step['action_input']),
+            ''
+        )
+        workflow = next(
+            (step['workflow'] for step in result['steps'][::-1] if step.get('workflow', '')),
+            ''
+        )
+    else:
+        action_input = next(
+            (step['action_input'] for step in result['steps'] if step['action_input']),
+            ''
+        )
+        workflow = next(
+            (step['workflow'] for step in result['steps'] if step.get('workflow', '')),
+            ''
+        )
+
+    if model_name == 'deepseek-r1':
+        if agent_type == 'REACT' or agent_type == 'REFLEXION':
+            workflow = next(
+                (step['content'][:step['content'].find('```python')] for step in result['steps'][::-1] if step['content'].find('```python') != -1),
+                ''
+            )
+        else:
+            workflow = next(
+                (step['content'][:step['content'].find('```python')] for step in result['steps']),
+                ''
+            )
+
+    if not evaluated_accuracy:
+        dataset_specific_prompt = ''
+        if sample.name == 'DiscoveryBench':
+            dataset_specific_prompt = "\nFor numerical questions, any predicted answer within 1% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 1% to make your decision.\n"
+        if sample.name == 'QRData':
+            dataset_specific_prompt = "\nFor numerical questions, any result within 3% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 3% to make your decision.\n"
+        if sample.name == 'StatQA':
+            dataset_specific_prompt = "\nPlease evaluate the accuracy of the predicted answer. As long as the predicted method aligns with the objective, it is acceptable. Then you should score based on the conclusion. If the predicted conclusion matches with the ground truth conclusion, score 1. If there are conflicting conclusions in the ground truth answers, as long as the predicted answer mentions any conclusion, it should be scored 1. For numerical questions, any result within 1% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 1% to make your decision.\n"
+        record['accuracy_score'] = evaluator.accuracy(
+            question=sample.question,
+            predicted_answer=result['final_answer'],
+            true_answer=sample.answer,
+            dataset_specific_prompt=dataset_specific_prompt
+        )
+
+    if not evaluated_reproducibility:
+        reproducibility_score, reason = evaluator.llm_reproducibility(
+            sample=sample,
+            code=action_input,
+            workflow=workflow,
+            final_answer=result['final_answer']
+        )
+        record.update({
+            "reproducibility_score": reproducibility_score,
+            "reason": reason,
+            "original_code": evaluator.original_codes[-1],
+            "converted_code": evaluator.converted_codes[-1],
+            "human_prompt": evaluator.human_prompts[-1],
+        })
+
+    record['input_tokens'] = record.get('input_tokens', 0) + evaluator.input_tokens - tokens_before[0]
+    record['output_tokens'] = record.get('output_tokens', 0) + evaluator.output_tokens - tokens_before[1]
+    return record, True
+
 @click.command()
 @click.option('--dataset_name', required=True, help='Name of the dataset to run experiments on.')
 @click.option('--model_name', required=True, help='Name of the model to use.')
@@ -27,8 +127,41 @@ def get_accuracy_by_reproducibility(accuracy_scores, reproducibility_scores):
 @click.option('--accuracy', is_flag=True, help='Flag to compute accuracy.')
 @click.option('--reproducibility', is_flag=True, help='Flag to compute reproducibility.')
 @click.option('--all_metrics', is_flag=True, help='Flag to compute all metrics.')
-def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_metrics):
-    collection = load_datasets()
+@click.option('--resume', is_flag=True, help='Flag to skip samples already scored in the evaluation checkpoint.')
+@click.option('--reuse_observations', is_flag=True, help='Flag to reuse the code outputs recorded in the experiment results instead of executing the code again.')
+@click.option('--speculative_conversion', is_flag=True, help='Flag to convert the workflow into code while the original code is executed, even if it then fails.')
+@click.option('--concurrency', default=1, show_default=True, type=click.IntRange(min=1), help='Number of samples evaluated concurrently.')
+@click.option('--sandbox_workers', default=0, show_default=True, type=click.IntRange(min=0), help='Number of worker processes executing generated code (0 executes in-process).')
+@click.option('--exec_timeout', default=None, type=float, help='Wall time limit of one code execution in seconds.')
+@click.option('--exec_cpu_time', default=None, type=float, help='CPU time limit of one code execution in seconds.')
+@click.option('--exec_memory_mb', default=None, type=float, help='Memory limit of a code execution worker in MB.')
+@click.option('--dataframe_cache_mb', default=None, type=float, help='Size in MB of the cache of DataFrames loaded by generated code (disabled by default).')
+@click.option('--max_observation_bytes', default=None, type=click.IntRange(min=1), help='Maximum size of a code output in bytes; the head and tail are kept around an elision marker (unbounded by default).')
+@click.option('--max_observation_lines_per_second', default=None, type=click.FloatRange(min=0, min_open=True), help='Lines of code output kept per second of execution; faster lines are dropped (unlimited by default).')
+@click.option('--capture_fd_output', is_flag=True, help='Flag to also capture output written to file descriptors 1 and 2, e.g. by C extensions (executes code in a sandbox worker).')
+@click.option('--llm_cache', default=None, help='Path to a SQLite file caching LLM responses.')
+@click.option('--llm_cache_max_mb', default=1024, show_default=True, type=float, help='Maximum size of the LLM response cache in MB.')
+@click.option('--max_connections', default=32, show_default=True, type=int, help='Maximum number of pooled HTTP connections per model provider.')
+@click.option('--rate_limit_config', default=os.path.join('config', 'rate_limit_config.json'), show_default=True, help='JSON file with the request and token limits of each model provider.')
+@click.option('--metrics_interval', default=60, show_default=True, type=float, help='Seconds between two writes of the run metrics (0 writes them only at the end).')
+@click.option('--trace', default=None, help='Path to a Chrome trace JSON file recording the spans of every sample (disabled by default).')
+def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_metrics, resume, reuse_observations, speculative_conversion, concurrency, sandbox_workers, exec_timeout, exec_cpu_time, exec_memory_mb, dataframe_cache_mb, max_observation_bytes, max_observation_lines_per_second, capture_fd_output, llm_cache, llm_cache_max_mb, max_connections, rate_limit_config, metrics_interval, trace):
+    configure_dataframe_cache(dataframe_cache_mb)
+    output_capture = dict(max_bytes=max_observation_bytes, max_lines_per_second=max_observation_lines_per_second,
+                          capture_fds=capture_fd_output)
+    configure_output_capture(**output_capture)
+    configure_sandbox(sandbox_workers, cpu_time=exec_cpu_time, wall_time=exec_timeout, max_memory_mb=exec_memory_mb,
+                      dataframe_cache_mb=dataframe_cache_mb, output_capture=output_capture)
+    configure_llm_cache(llm_cache, llm_cache_max_mb)
+    configure_http_pool(max_connections)
+    configure_rate_limits(rate_limit_config)
+    configure_metrics(
+        os.path.join(os.path.abspath(""), 'results', f'{model_name}_{dataset_name}_{agent_type}_eval_metrics.json'),
+        labels={"model": model_name, "dataset": dataset_name, "agent_type": agent_type, "judge": "gpt-4o-2024-11-20", "concurrency": concurrency},
+        interval=metrics_interval
+    )
+    configure_tracing(trace)
+    collection = load_datasets(names=[dataset_name])
     dataset = collection.get_dataset(dataset_name)
     if all_metrics:
         accuracy, reproducibility = True, True
@@ -38,11 +171,16 @@ def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_me
         return
     
     parent_dir = os.path.abspath("")
-    reproducibility_evaluator = Reproducibility()
     results_path = os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}.json')
     with open(results_path, 'r') as f:
         dataset_results = json.load(f)
 
+    execution_cache = None
+    if reuse_observations:
+        execution_cache = ExecutionCache()
+        time_print(f'Cached {execution_cache.add_results(dataset_results, dataset)} recorded code outputs.')
+    reproducibility_evaluator = Reproducibility(execution_cache=execution_cache, speculative_conversion=speculative_conversion)
+
     input_tokens, output_tokens = 0, 0
     for idx in dataset_results:
         if 'steps' not in dataset_results[idx]: continue
@@ -56,100 +194,84 @@ def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_me
         indices = sample_StatQA(dataset)
 
     if agent_type == 'REFLEXION':
-        indices = list(get_irreproducible_idx(model_name=model_name, dataset_name=dataset_name, agent_type='COT'))
+        indices = list(get_irreproducible_idx(model_name=model_name, dataset_name=dataset_name, agent_type='COT', dataset=dataset))
+
+    # Scores and artifacts of every sample are checkpointed, so a crashed evaluation can be resumed
+    checkpoint = ResultsStore(os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_eval_checkpoint.jsonl'))
+    if not resume:
+        checkpoint.clear()
+    checkpoint_records = checkpoint.load()
+    if checkpoint_records:
+        time_print(f'Resuming from {len(checkpoint_records)} checkpointed samples.')
 
     accuracy_scores = []
     reproducibility_scores = []
     reproducibility_reasons = []
+    original_codes = []
+    converted_codes = []
+    human_prompts = []
+    input_tokens, output_tokens = 0, 0
 
-    for j, (idx, sample) in enumerate(zip(dataset_results, dataset.sample_generator())):
-        if int(idx) not in indices:
-            continue
-
-        j = int(idx)
-        sample = dataset.get_sample(j)
-            
-        result = dataset_results[idx]
+    if not accuracy:
+        old_files_pattern = os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_results_*.json')
+        for old_file in glob.glob(old_files_pattern):
+            old_data = json.load(open(old_file))
+            if 'accuracy_scores' in old_data:
+                accuracy_scores = old_data['accuracy_scores']
 
-        if agent_type == 'REACT' or agent_type == 'REFLEXION':
-            action_input = next(
-                (step['action_input'] for step in result['steps'][::-1] if step['action_input']),
-                ''
-            )
-            workflow = next(
-                (step['workflow'] for step in result['steps'][::-1] if step.get('workflow', '')),
-                ''
-            )
-        else:
-            action_input = next(
-                (step['action_input'] for step in result['steps'] if step['action_input']),
-                ''
-            )
-            workflow = next(
-                (step['workflow'] for step in result['steps'] if step.get('workflow', '')),
-                ''
+    # Each worker thread scores its samples with its own evaluator, while the scores are consumed
+    # here in sample order, so logging, checkpoints and outputs do not depend on the concurrency
+    evaluators = threading.local()
+    evaluators.evaluator = reproducibility_evaluator
+    def score_sample(idx):
+        if not hasattr(evaluators, 'evaluator'):
+            evaluators.evaluator = Reproducibility(execution_cache=execution_cache, speculative_conversion=speculative_conversion)
+        with trace_sample(int(idx)), timer('sample'):
+            return evaluate_sample(
+                evaluators.evaluator,
+                sample=dataset.get_sample(int(idx)),
+                result=dataset_results[idx],
+                record=dict(checkpoint_records.get(idx, {})),
+                model_name=model_name,
+                agent_type=agent_type,
+                accuracy=accuracy,
+                reproducibility=reproducibility
             )
 
-        if model_name == 'deepseek-r1':
-            if agent_type == 'REACT' or agent_type == 'REFLEXION':
-                workflow = next(
-                    (step['content'][:step['content'].find('```python')] for step in result['steps'][::-1] if step['content'].find('```python') != -1),
-                    ''
-                )
-            else:
-                workflow = next(
-                    (step['content'][:step['content'].find('```python')] for step in result['steps']),
-                    ''
-                )
-
-        if accuracy:
-            dataset_specific_prompt = ''
-            if sample.name == 'DiscoveryBench':
-                dataset_specific_prompt = "\nFor numerical questions, any predicted answer within 1% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 1% to make your decision.\n"
-            if sample.name == 'QRData':
-                dataset_specific_prompt = "\nFor numerical questions, any result within 3% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 3% to make your decision.\n"
-            if sample.name == 'StatQA':
-                dataset_specific_prompt = "\nPlease evaluate the accuracy of the predicted answer. As long as the predicted method aligns with the objective, it is acceptable. Then you should score based on the conclusion. If the predicted conclusion matches with the ground truth conclusion, score 1. If there are conflicting conclusions in the ground truth answers, as long as the predicted answer mentions any conclusion, it should be scored 1. For numerical questions, any result within 1% of the ground truth answer is considered correct. Please compare abs(predicted-ground_truth)/abs(ground_truth) with 1% to make your decision.\n"
-            accuracy_score = reproducibility_evaluator.accuracy(
-                question=sample.question,
-                predicted_answer=result['final_answer'],
-                true_answer=sample.answer,
-                dataset_specific_prompt=dataset_specific_prompt
-            )
-            accuracy_scores.append(accuracy_score)
-            time_print(f'Sample {idx}: Accuracy score: {accuracy_score}')
-            if len(accuracy_scores) % 40 == 0:
-                time_print(f'Running {len(accuracy_scores)} average accuracy score: {np.mean(accuracy_scores)}')
-        else:
-            old_files_pattern = os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_results_*.json')
-            for old_file in glob.glob(old_files_pattern):
-                old_data = json.load(open(old_file))
-                if 'accuracy_scores' in old_data:
-                    accuracy_scores = old_data['accuracy_scores']
-
-        if reproducibility:
-            reproducibility_score, reason = reproducibility_evaluator.llm_reproducibility(
-                sample=sample,
-                code=action_input,
-                workflow=workflow,
-                final_answer=result['final_answer']
-            )
-            reproducibility_scores.append(reproducibility_score)
-            reproducibility_reasons.append(reason)
-            time_print(f'Sample {idx}: Reproducibility score: {reproducibility_score}')
-            if len(reproducibility_scores) % 20 == 0:
-                num_1, num_0, acc_1, acc_0 = get_accuracy_by_reproducibility(accuracy_scores, reproducibility_scores)
-                time_print(f'Accuracy (reproducibility=1): {acc_1:.4f} (num: {num_1}); Accuracy (reproducibility=0): {acc_0:.4f} (num: {num_0})')
-
-        if reproducibility_evaluator.converted_codes:
-            with open(os.path.join(parent_dir, 'results', 'converted_codes.json'), 'w') as f:
-                json.dump([{"index": i, "converted_code": converted_code, "original_code": reproducibility_evaluator.original_codes[i], "reason": reproducibility_reasons[i]} for i, converted_code in enumerate(reproducibility_evaluator.converted_codes)], f, indent=4)
-        if reproducibility_evaluator.converted_workflows:
-            with open(os.path.join(parent_dir, 'results', 'converted_workflows.json'), 'w') as f:
-                json.dump([{"index": i, "converted_workflow": converted_workflow, "original_workflow": reproducibility_evaluator.original_workflows[i], "reason": reproducibility_reasons[i]} for i, converted_workflow in enumerate(reproducibility_evaluator.converted_workflows)], f, indent=4)
-        if reproducibility_evaluator.human_prompts:
-            with open(os.path.join(parent_dir, 'results', 'human_prompts.json'), 'w') as f:
-                json.dump([{"index": i, "human_prompts": human_prompts} for i, human_prompts in enumerate(reproducibility_evaluator.human_prompts)], f, indent=4)
+    selected = [idx for idx, _ in zip(dataset_results, dataset.sample_generator()) if int(idx) in indices]
+    executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+    try:
+        scored = executor.map(score_sample, selected) if executor else map(score_sample, selected)
+        for idx, (record, updated) in zip(selected, scored):
+            if accuracy:
+                accuracy_scores.append(record['accuracy_score'])
+                time_print(f'Sample {idx}: Accuracy score: {record["accuracy_score"]}')
+                if len(accuracy_scores) % 40 == 0:
+                    time_print(f'Running {len(accuracy_scores)} average accuracy score: {np.mean(accuracy_scores)}')
+
+            if reproducibility:
+                reproducibility_scores.append(record['reproducibility_score'])
+                reproducibility_reasons.append(record['reason'])
+                original_codes.append(record['original_code'])
+                converted_codes.append(record['converted_code'])
+                human_prompts.append(record['human_prompt'])
+                time_print(f'Sample {idx}: Reproducibility score: {record["reproducibility_score"]}')
+                if len(reproducibility_scores) % 20 == 0:
+                    num_1, num_0, acc_1, acc_0 = get_accuracy_by_reproducibility(accuracy_scores, reproducibility_scores)
+                    time_print(f'Accuracy (reproducibility=1): {acc_1:.4f} (num: {num_1}); Accuracy (reproducibility=0): {acc_0:.4f} (num: {num_0})')
+
+            get_metrics().count_sample()
+            if updated:
+                with timer('checkpoint_append'):
+                    checkpoint.append(idx, record)
+            input_tokens += record.get('input_tokens', 0)
+            output_tokens += record.get('output_tokens', 0)
+    finally:
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        finish_metrics()
+        finish_tracing()
+    checkpoint.close()
 
     time_print(f"Accuracy score of {len(accuracy_scores)} samples: {np.mean(accuracy_scores)}")
     results = {
@@ -169,9 +291,9 @@ def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_me
         os.remove(old_file)
 
     results.update({
-        "input_tokens": reproducibility_evaluator.input_tokens,
-        "output_tokens": reproducibility_evaluator.output_tokens,
-        "cost": reproducibility_evaluator.input_tokens*2.5/1000000+reproducibility_evaluator.output_tokens*10/1000000
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost": input_tokens*2.5/1000000+output_tokens*10/1000000
     })
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -180,15 +302,15 @@ def main(dataset_name, model_name, agent_type, accuracy, reproducibility, all_me
         json.dump(results, f, indent=4)
     
     if reproducibility:
-        if reproducibility_evaluator.converted_codes:
+        if converted_codes:
             with open(os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_converted_codes.json'), 'w') as f:
-                json.dump([{"index": i, "converted_code": converted_code, "original_code": reproducibility_evaluator.original_codes[i], "reason": reproducibility_reasons[i]} for i, converted_code in enumerate(reproducibility_evaluator.converted_codes)], f, indent=4)
+                json.dump([{"index": i, "converted_code": converted_code, "original_code": original_codes[i], "reason": reproducibility_reasons[i]} for i, converted_code in enumerate(converted_codes)], f, indent=4)
         if reproducibility_evaluator.converted_workflows:
             with open(os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_converted_workflows.json'), 'w') as f:
                 json.dump([{"index": i, "converted_workflow": converted_workflow, "original_workflow": reproducibility_evaluator.original_workflows[i], "reason": reproducibility_reasons[i]} for i, converted_workflow in enumerate(reproducibility_evaluator.converted_workflows)], f, indent=4)
-        if reproducibility_evaluator.human_prompts:
+        if human_prompts:
             with open(os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}_human_prompts.json'), 'w') as f:
-                json.dump([{"index": i, "human_prompts": human_prompts} for i, human_prompts in enumerate(reproducibility_evaluator.human_prompts)], f, indent=4)
+                json.dump([{"index": i, "human_prompts": human_prompt} for i, human_prompt in enumerate(human_prompts)], f, indent=4)
     
     time_print(f'Results saved to {output_path}')
     
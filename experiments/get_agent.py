@@ -1,7 +1,4 @@
 from enum import Enum
-from agents.cot_agent import ChainOfThoughtAgent
-from agents.react_agent import ReActAgent
-from agents.reflexion_agent import ReflexionAgent
 
 class AgentType(Enum):
     COT = "chain_of_thought"
@@ -11,13 +8,18 @@ class AgentType(Enum):
 
 def get_agent(agent_type: AgentType, model_config: str, api_config: str, model_name: str):
     """Factory function to get the appropriate agent."""
+    # Agent modules are imported on demand so that only the selected agent's dependencies are loaded
     if agent_type == AgentType.COT:
+        from agents.cot_agent import ChainOfThoughtAgent
         return ChainOfThoughtAgent(model_config, api_config, model_name)
     elif agent_type == AgentType.ROT:
+        from agents.cot_agent import ChainOfThoughtAgent
         return ChainOfThoughtAgent(model_config, api_config, model_name)
     elif agent_type == AgentType.REFLEXION:
+        from agents.reflexion_agent import ReflexionAgent
         return ReflexionAgent(model_config, api_config, model_name)
     elif agent_type == AgentType.REACT:
+        from agents.react_agent import ReActAgent
         return ReActAgent(model_config, api_config, model_name)
     else:
         raise ValueError(f"Unknown agent type: {agent_type}")
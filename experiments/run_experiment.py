@@ -3,9 +3,22 @@ import json
 from enum import Enum
 import warnings
 import click
-from collections import OrderedDict
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils.load_data import load_datasets
 from utils.time_print import time_print
+from utils.sandbox import configure_sandbox
+from utils.llm_cache import configure_llm_cache
+from utils.model_registry import configure_http_pool, set_chat_model_factory
+from utils.rate_limiter import configure_rate_limits
+from utils.metrics import configure_metrics, finish_metrics, get_metrics, timer
+from utils.tracing import configure_tracing, finish_tracing, trace_sample
+from utils.replay_llm import ReplayChatModel, find_divergence
+from utils.streaming import configure_streaming
+from agents.prompt_builder import PROMPT_BUDGET_POLICIES, configure_prompt_budget
+from utils.dataframe_cache import configure_dataframe_cache
+from utils.output_capture import configure_output_capture
+from utils.results_store import ResultsStore, export_results
 from utils.sample_StatQA import sample_StatQA
 from utils.get_CoT_irreproducible_idx import get_irreproducible_idx
 from .get_agent import AgentType, get_agent, get_agent_instruction, get_agent_type
@@ -13,16 +26,103 @@ from .get_agent import AgentType, get_agent, get_agent_instruction, get_agent_ty
 warnings.filterwarnings("ignore")
 
 
+# Agents of the current thread, reused across samples to keep model clients and their connections
+_thread_agents = threading.local()
+
+
+def run_sample(sample, agent_type_enum, model_name, parent_dir, index=None, llm=None):
+    """
+    Run an agent on a single sample.
+
+    Each worker thread creates one agent per configuration and resets it between samples.
+
+    Args:
+        sample (DataSample): The sample to solve.
+        agent_type_enum (AgentType): Type of the agent to use.
+        model_name (str): Name of the model to use.
+        parent_dir (str): Repository root containing the `config` folder.
+        index (int): Index of the sample, which groups its spans in the trace.
+        llm (object): Chat model answering the agent for this sample instead of its own model,
+            e.g. a `ReplayChatModel`.
+
+    Returns:
+        dict: The agent response together with the ground truth answer.
+    """
+    if not hasattr(_thread_agents, 'agents'):
+        _thread_agents.agents = {}
+    key = (agent_type_enum, model_name, parent_dir)
+    if key not in _thread_agents.agents:
+        _thread_agents.agents[key] = get_agent(
+            agent_type=agent_type_enum, 
+            model_config=os.path.join(parent_dir, 'config', 'model_config.json'),
+            api_config=os.path.join(parent_dir, 'config', 'api_config.json'),
+            model_name=model_name
+        )
+    agent = _thread_agents.agents[key]
+    agent.reset()
+    agent.llm = llm if llm is not None else agent.get_model()
+
+    with trace_sample(index), timer('sample'):
+        response = agent.run(sample, get_agent_instruction(agent_type_enum), deepseek=(model_name=='deepseek-r1'))
+    response.update({"answer": sample.answer})
+    return response
+
+
 @click.command()
 @click.option('--dataset_name', required=True, help='Name of the dataset to run experiments on.')
 @click.option('--model_name', required=True, help='Name of the model to use.')
 @click.option('--agent_type', required=True, type=click.Choice(['COT', 'ROT', 'REACT', 'REFLEXION']), help='Type of the agent to use.')
-@click.option('--overwrite', is_flag=True, help='Flag to overwrite results file if it exists.')
-def run_experiment(dataset_name, model_name, agent_type, overwrite):
+@click.option('--overwrite', is_flag=True, help='Flag to overwrite results file if it exists. Otherwise, samples already in the results file are skipped.')
+@click.option('--concurrency', default=1, show_default=True, type=click.IntRange(min=1), help='Number of samples to run at once.')
+@click.option('--sandbox_workers', default=0, show_default=True, type=click.IntRange(min=0), help='Number of worker processes executing generated code (0 executes in-process).')
+@click.option('--exec_timeout', default=None, type=float, help='Wall time limit of one code execution in seconds.')
+@click.option('--exec_cpu_time', default=None, type=float, help='CPU time limit of one code execution in seconds.')
+@click.option('--exec_memory_mb', default=None, type=float, help='Memory limit of a code execution worker in MB.')
+@click.option('--dataframe_cache_mb', default=None, type=float, help='Size in MB of the cache of DataFrames loaded by generated code (disabled by default).')
+@click.option('--max_observation_bytes', default=None, type=click.IntRange(min=1), help='Maximum size of a code output in bytes; the head and tail are kept around an elision marker (unbounded by default).')
+@click.option('--max_observation_lines_per_second', default=None, type=click.FloatRange(min=0, min_open=True), help='Lines of code output kept per second of execution; faster lines are dropped (unlimited by default).')
+@click.option('--capture_fd_output', is_flag=True, help='Flag to also capture output written to file descriptors 1 and 2, e.g. by C extensions (executes code in a sandbox worker).')
+@click.option('--llm_cache', default=None, help='Path to a SQLite file caching LLM responses.')
+@click.option('--llm_cache_max_mb', default=1024, show_default=True, type=float, help='Maximum size of the LLM response cache in MB.')
+@click.option('--max_connections', default=32, show_default=True, type=int, help='Maximum number of pooled HTTP connections per model provider.')
+@click.option('--rate_limit_config', default=os.path.join('config', 'rate_limit_config.json'), show_default=True, help='JSON file with the request and token limits of each model provider.')
+@click.option('--metrics_interval', default=60, show_default=True, type=float, help='Seconds between two writes of the run metrics (0 writes them only at the end).')
+@click.option('--trace', default=None, help='Path to a Chrome trace JSON file recording the spans of every sample (disabled by default).')
+@click.option('--replay', default=None, help='Results JSON whose recorded LLM outputs are fed back to the agent instead of calling the model.')
+@click.option('--stream_early_stop', is_flag=True, help='Flag to stream completions of the CoT/ROT and ReAct agents and stop them once the code block (or "Task done") is complete.')
+@click.option('--prompt_budget_policy', default='none', show_default=True, type=click.Choice(PROMPT_BUDGET_POLICIES), help='How agent prompts exceeding the context budget of the model are shortened.')
+@click.option('--prompt_budget_tokens', default=None, type=click.IntRange(min=1), help='Prompt token budget of the model (by default its context size minus its completion size, if declared).')
+def run_experiment(dataset_name, model_name, agent_type, overwrite, concurrency, sandbox_workers, exec_timeout, exec_cpu_time, exec_memory_mb, dataframe_cache_mb, max_observation_bytes, max_observation_lines_per_second, capture_fd_output, llm_cache, llm_cache_max_mb, max_connections, rate_limit_config, metrics_interval, trace, replay, stream_early_stop, prompt_budget_policy, prompt_budget_tokens):
     parent_dir = os.path.abspath("")
+    run_name = f'{model_name}_{dataset_name}_{agent_type}'
+    recorded = {}
+    if replay:
+        # Only parsing and code execution run again; no model client is created
+        with open(replay, 'r') as f:
+            recorded = json.load(f)
+        set_chat_model_factory(lambda model_type, model_name: ReplayChatModel([]))
+        run_name += '_replay'
+    configure_dataframe_cache(dataframe_cache_mb)
+    output_capture = dict(max_bytes=max_observation_bytes, max_lines_per_second=max_observation_lines_per_second,
+                          capture_fds=capture_fd_output)
+    configure_output_capture(**output_capture)
+    configure_sandbox(sandbox_workers, cpu_time=exec_cpu_time, wall_time=exec_timeout, max_memory_mb=exec_memory_mb,
+                      dataframe_cache_mb=dataframe_cache_mb, output_capture=output_capture)
+    configure_llm_cache(llm_cache, llm_cache_max_mb)
+    configure_http_pool(max_connections)
+    configure_rate_limits(rate_limit_config)
+    configure_metrics(
+        os.path.join(parent_dir, 'results', f'{run_name}_metrics.json'),
+        labels={"model": model_name, "dataset": dataset_name, "agent_type": agent_type, "concurrency": concurrency, "replay": replay,
+                "stream_early_stop": stream_early_stop},
+        interval=metrics_interval
+    )
+    configure_tracing(trace)
+    configure_streaming(stream_early_stop)
+    configure_prompt_budget(prompt_budget_policy, prompt_budget_tokens)
 
     # Load the datasets
-    collection = load_datasets()
+    collection = load_datasets(names=[dataset_name])
     dataset = collection.get_dataset(dataset_name)
 
     # Convert agent_type string to AgentType enum
@@ -32,10 +132,15 @@ def run_experiment(dataset_name, model_name, agent_type, overwrite):
     output_dir = os.path.join(parent_dir, 'results')
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    output_file = os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_{agent_type}.json')
+    output_file = os.path.join(parent_dir, 'results', f'{run_name}.json')
+    # Every finished sample is appended to the JSONL store; the JSON file is exported from it at the end
+    store = ResultsStore(os.path.join(parent_dir, 'results', f'{run_name}.jsonl'))
+    if overwrite:
+        store.clear()
+    stored_results = store.load()
 
     # Load existing results if not overwriting
-    if not overwrite and os.path.exists(output_file):
+    if not overwrite and not stored_results and os.path.exists(output_file):
         with open(output_file, 'r') as f:
             results = json.load(f)
 
@@ -43,41 +148,72 @@ def run_experiment(dataset_name, model_name, agent_type, overwrite):
     if dataset_name == 'StatQA':
         indices = sample_StatQA(dataset)
 
-    if agent_type == 'REFLEXION':
+    if replay:
+        # Replay exactly the recorded samples
+        indices = {int(idx) for idx, result in recorded.items() if 'steps' in result}
+    elif agent_type == 'REFLEXION':
         with open(os.path.join(parent_dir, 'results', f'{model_name}_{dataset_name}_COT.json'), 'r') as f:
             results = json.load(f)
-        indices = get_irreproducible_idx(model_name=model_name, dataset_name=dataset_name, agent_type='COT')
+        indices = get_irreproducible_idx(model_name=model_name, dataset_name=dataset_name, agent_type='COT', dataset=dataset)
         for i in range(len(dataset.samples)):
             if str(i) in results and i not in indices:
                 # Remove reproducible samples
                 results.pop(str(i))
+    results.update(stored_results)
 
     # Iterate through the dataset samples
+    selected_samples = []
     for i, sample in enumerate(dataset.sample_generator()):
         if i not in indices:
             results[str(i)] = {"final_answer": "Sample not included"}
+            if stored_results.get(str(i)) != results[str(i)]:
+                store.append(i, results[str(i)])
             continue
+        if 'steps' in stored_results.get(str(i), {}):
+            # Finished in an earlier run
+            continue
+        selected_samples.append((i, sample))
+    if len(selected_samples) < len(indices):
+        time_print(f'Resuming: {len(indices) - len(selected_samples)} samples already finished.')
 
-        agent = get_agent(
-            agent_type=agent_type_enum, 
-            model_config=os.path.join(parent_dir, 'config', 'model_config.json'),
-            api_config=os.path.join(parent_dir, 'config', 'api_config.json'),
-            model_name=model_name
-        )
+    # Samples are independent, so up to `concurrency` of them are in flight at once.
+    # Without sandbox workers code execution is serialized, so this mainly overlaps LLM calls.
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    diverged = 0
+    try:
+        replay_llms = {i: ReplayChatModel(recorded[str(i)]['steps']) for i, _ in selected_samples} if replay else {}
+        futures = {
+            executor.submit(run_sample, sample, agent_type_enum, model_name, parent_dir, i, replay_llms.get(i)): i
+            for i, sample in selected_samples
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            response = future.result()
+            if response['final_answer'] != "No final answer reached":
+                time_print(f'Sample {i} finished.')
+            else:
+                time_print(f'Sample {i} failed.')
+            if replay:
+                divergence = find_divergence(recorded[str(i)]['steps'], response['steps'], replay_llms[i].exhausted)
+                response['replay_divergence'] = divergence
+                if divergence:
+                    diverged += 1
+                    time_print(f'Sample {i} diverges from the recording at step {divergence["step"]} ({divergence["field"]}).')
+            results[str(i)] = response
+            get_metrics().count_sample()
 
-        response = agent.run(sample, get_agent_instruction(agent_type_enum), deepseek=(model_name=='deepseek-r1'))
-        response.update({"answer": sample.answer})
-        if response['final_answer'] != "No final answer reached":
-            time_print(f'Sample {i} finished.')
-        else:
-            time_print(f'Sample {i} failed.')
-        results[str(i)] = response
-
-        # Save results incrementally
-        results = OrderedDict(sorted(results.items(), key=lambda x: int(x[0])))
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
+            # Save results incrementally
+            with timer('store_append'):
+                store.append(i, response)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        store.compact()
+        export_results(results, output_file)
+        finish_metrics()
+        finish_tracing()
 
+    if replay:
+        time_print(f'{diverged} of {len(selected_samples)} replayed samples diverge from the recording.')
     time_print("Experiment completed.")
 
 if __name__ == '__main__':
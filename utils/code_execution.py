@@ -1,43 +1,113 @@
-import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, classification_report
-from sklearn.utils import resample
-import matplotlib.pyplot as plt
-from statsmodels.tsa.stattools import grangercausalitytests
-from scipy import stats
-from scipy.stats import pearsonr, ttest_ind, norm
-from sklearn.preprocessing import LabelEncoder
-from statsmodels.formula.api import logit, ols
-from statsmodels.stats.anova import anova_lm
-from sklearn.linear_model import LogisticRegression
-from sklearn.impute import SimpleImputer
-from scipy.stats import chi2_contingency
-import seaborn as sns
-from statsmodels.regression.linear_model import OLS
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import mean_squared_error
-from sklearn.ensemble import RandomForestRegressor
-from statsmodels.stats.proportion import proportions_ztest
-from scipy.stats import linregress
-from econml.dml import DML
-from statsmodels.stats.proportion import proportion_confint
-from statsmodels.tsa.stattools import grangercausalitytests
-import statsmodels.api as sm
-from scipy.stats import bootstrap
-from scipy.stats import chisquare
-from sklearn.neighbors import NearestNeighbors
-from pingouin import partial_corr
-import pingouin as pg
-from Bio import Phylo
-
-import io
 import os
 import sys
-from contextlib import redirect_stdout
+import time
+import importlib
+import threading
+from contextlib import contextmanager, nullcontext
 from langchain_experimental.tools.python.tool import PythonAstREPLTool
 from pydantic import Field
+from .sandbox import get_sandbox
+from .dataframe_cache import get_dataframe_cache
+from .output_capture import BoundedOutput, capture_fd_output, get_output_capture
+
+# The analysis stack used by generated code. It is imported before the first execution
+# (or when a sandbox worker starts) instead of when this module is imported, so that
+# driver processes do not pay for it at startup.
+ANALYSIS_MODULES = [
+    'pandas',
+    'numpy',
+    'sklearn.model_selection',
+    'sklearn.linear_model',
+    'sklearn.metrics',
+    'sklearn.utils',
+    'matplotlib.pyplot',
+    'statsmodels.tsa.stattools',
+    'scipy.stats',
+    'sklearn.preprocessing',
+    'statsmodels.formula.api',
+    'statsmodels.stats.anova',
+    'sklearn.impute',
+    'seaborn',
+    'statsmodels.regression.linear_model',
+    'sklearn.ensemble',
+    'statsmodels.stats.proportion',
+    'econml.dml',
+    'statsmodels.api',
+    'sklearn.neighbors',
+    'pingouin',
+    'Bio.Phylo',
+]
+_import_times = None
+_import_lock = threading.Lock()
+
+# Generated code changes the working directory of the whole process, so in-process
+# executions are serialized even when several samples are processed concurrently.
+_exec_lock = threading.Lock()
+
+
+def preload_analysis_stack():
+    """
+    Import the analysis stack once per process.
+
+    Returns:
+        list: `(module, seconds)` pairs with the time each module added to the first import.
+    """
+    global _import_times
+    with _import_lock:
+        if _import_times is None:
+            import_times = []
+            for module in ANALYSIS_MODULES:
+                start = time.perf_counter()
+                importlib.import_module(module)
+                import_times.append((module, time.perf_counter() - start))
+            _import_times = import_times
+    return _import_times
+
+
+def import_time_report() -> str:
+    """Format the import time of every module of the analysis stack, slowest first."""
+    import_times = preload_analysis_stack()
+    lines = [f'{seconds:8.3f}s  {module}' for module, seconds in sorted(import_times, key=lambda x: -x[1])]
+    lines.append(f'{sum(seconds for _, seconds in import_times):8.3f}s  total')
+    return '\n'.join(lines)
+
+
+class _ThreadLocalStdout:
+    """Stdout proxy that sends writes of a capturing thread to its own stream."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def _target(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+
+@contextmanager
+def capture_stdout(stream):
+    """
+    Redirect the stdout of the current thread to `stream`.
+
+    Unlike `contextlib.redirect_stdout`, prints from other threads (e.g. progress messages of
+    concurrently running samples) are not captured.
+    """
+    if not isinstance(sys.stdout, _ThreadLocalStdout):
+        sys.stdout = _ThreadLocalStdout(sys.stdout)
+    sys.stdout.local.stream = stream
+    try:
+        yield stream
+    finally:
+        sys.stdout.local.stream = None
+
 
 class CustomPythonAstREPLTool(PythonAstREPLTool):
     """Custom Python REPL tool that limits the number of code executions."""
@@ -60,40 +130,69 @@ class CustomPythonAstREPLTool(PythonAstREPLTool):
     def _run(self, query: str, change_dir: str = None) -> str:
         """
         Override _run to capture print statements as well as the final evaluated result.
+        The code runs in a pre-warmed worker process if a sandbox pool is configured
+        (see `utils.sandbox.configure_sandbox`), otherwise in the current process.
         """
-        if change_dir:
-            import os
-            os.chdir(change_dir)
-
-        # Initialize a stream to capture output
-        output_stream = io.StringIO()
         self.max_turns += 1
 
-        # Define custom exit and quit functions
-        def fake_exit(*args):
-            print("Intercepted exit/quit call.")
-
-        # Redirect stdout to capture print statements
-        with redirect_stdout(output_stream):
-            try:
-                # Use exec to execute the query, as it allows print outputs
-                shared_namespace = {"exit": fake_exit, "quit": fake_exit}
-                exec(query, shared_namespace, shared_namespace)
-                result = ""  # No errors, so no explicit result
-            except Exception as e:
-                # Capture errors
-                error_category = type(e).__name__
-                result = f"Error [{error_category}]: {str(e)}"
-
-        # Combine print output and any explicit result
-        captured_output = output_stream.getvalue()
-        output_stream.close()
-        final_output = (captured_output + result).strip()
+        sandbox = get_sandbox()
+        if sandbox is not None:
+            final_output = sandbox.run(query, change_dir=change_dir)
+        else:
+            with _exec_lock:
+                final_output = execute_code(query, change_dir=change_dir)
         
         if self.max_turns >= self.max_runs:
             final_output += '\n' + self.reach_limit_message
 
         return final_output
 
+
+def execute_code(query: str, change_dir: str = None) -> str:
+    """
+    Execute generated code in the current process and return its observation.
+
+    Args:
+        query (str): Python code to execute.
+        change_dir (str): Directory to switch to before executing the code.
+
+    Returns:
+        str: Captured print output followed by the error message, if any.
+    """
+    preload_analysis_stack()
+    if change_dir:
+        os.chdir(change_dir)
+
+    # Initialize a stream to capture output, bounded if configured (see `utils.output_capture`)
+    output_capture = get_output_capture()
+    output_stream = BoundedOutput(output_capture["max_bytes"], output_capture["max_lines_per_second"])
+    fd_context = capture_fd_output(output_stream) if output_capture["capture_fds"] else nullcontext()
+
+    # Define custom exit and quit functions
+    def fake_exit(*args):
+        print("Intercepted exit/quit call.")
+
+    # Serve repeated loads of the sample's data files from the DataFrame cache, if enabled
+    dataframe_cache = get_dataframe_cache()
+    cache_context = dataframe_cache.patch_pandas(change_dir) if dataframe_cache and change_dir else nullcontext()
+
+    # Redirect stdout to capture print statements
+    with capture_stdout(output_stream), fd_context, cache_context:
+        try:
+            # Use exec to execute the query, as it allows print outputs
+            shared_namespace = {"exit": fake_exit, "quit": fake_exit}
+            exec(query, shared_namespace, shared_namespace)
+            result = ""  # No errors, so no explicit result
+        except Exception as e:
+            # Capture errors
+            error_category = type(e).__name__
+            result = f"Error [{error_category}]: {str(e)}"
+
+    # Combine print output and any explicit result
+    captured_output = output_stream.getvalue()
+    output_stream.close()
+    return (captured_output + result).strip()
+
 if __name__ == '__main__':
-    pass
+    # Report how much each module of the analysis stack costs to import
+    print(import_time_report())
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
-from typing import Dict, Optional, List, Union
+from typing import Callable, Dict, Optional, List, Union
+import threading
 
 @dataclass
 class DataSample:
@@ -76,6 +77,8 @@ class DatasetCollection:
     """
     def __init__(self, names: str, datasets: List[Dataset]):
         self.datasets: Dict[str, Dataset] = {}  # Datasets stored by their name as a key
+        self.loaders: Dict[str, Callable[[], Dataset]] = {}  # Loaders of datasets not built yet
+        self._lock = threading.Lock()
         for name, dataset in zip(names, datasets):
             self.add_dataset(name, dataset)
 
@@ -83,11 +86,19 @@ class DatasetCollection:
         """Adds a new dataset to the collection."""
         self.datasets[name] = dataset
 
+    def add_loader(self, name: str, loader: Callable[[], Dataset]):
+        """Adds a dataset that is built by `loader` on its first access."""
+        self.loaders[name] = loader
+
     def get_dataset(self, name: str) -> Optional[Dataset]:
-        """Retrieves a dataset by name."""
+        """Retrieves a dataset by name, building it first if it has not been loaded yet."""
+        with self._lock:
+            if name not in self.datasets and name in self.loaders:
+                self.add_dataset(name, self.loaders.pop(name)())
         return self.datasets.get(name)
 
     def remove_dataset(self, name: str):
         """Removes a dataset by name."""
         if name in self.datasets:
-            del self.datasets[name]
\ No newline at end of file
+            del self.datasets[name]
+        self.loaders.pop(name, None)
\ No newline at end of file
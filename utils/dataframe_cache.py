@@ -0,0 +1,119 @@
+import os
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_dataframe_cache = None
+
+# Arguments that make the readers return something other than one DataFrame
+_UNCACHEABLE_ARGUMENTS = ('chunksize', 'iterator')
+
+
+class DataFrameCache:
+    """
+    Read-through cache of DataFrames loaded by generated code.
+
+    While `patch_pandas` is active, `pd.read_csv` and `pd.read_table` calls on files below the
+    sample directory return a copy of a frame parsed earlier with the same arguments. Frames are
+    evicted in least-recently-used order once their total memory exceeds `max_mb`.
+    """
+
+    def __init__(self, max_mb: float = 2048):
+        """
+        Args:
+            max_mb (float): Maximum total memory of the cached frames in MB.
+        """
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self.frames:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.frames.move_to_end(key)
+            return self.frames[key][0]
+
+    def _put(self, key, frame):
+        size = int(frame.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self.frames:
+                return
+            self.frames[key] = (frame, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.frames.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def _key(self, reader_name, path, args, kwargs, root_dir):
+        """Cache key of a read call, or None if the call must not be cached."""
+        if not isinstance(path, (str, os.PathLike)) or any(kwargs.get(name) for name in _UNCACHEABLE_ARGUMENTS):
+            return None
+        path = os.path.realpath(path)
+        if os.path.commonpath([path, os.path.realpath(root_dir)]) != os.path.realpath(root_dir) or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return (reader_name, path, stat.st_size, stat.st_mtime_ns, repr(args), repr(sorted(kwargs.items())))
+
+    def _cached_reader(self, reader_name, reader, root_dir):
+        import pandas as pd
+
+        @functools.wraps(reader)
+        def cached_reader(filepath_or_buffer, *args, **kwargs):
+            key = self._key(reader_name, filepath_or_buffer, args, kwargs, root_dir)
+            if key is None:
+                return reader(filepath_or_buffer, *args, **kwargs)
+            frame = self._get(key)
+            if frame is None:
+                frame = reader(filepath_or_buffer, *args, **kwargs)
+                if not isinstance(frame, pd.DataFrame):
+                    return frame
+                self._put(key, frame)
+            # Generated code may modify its frame in place, so it never gets the cached one
+            return frame.copy()
+        return cached_reader
+
+    @contextmanager
+    def patch_pandas(self, root_dir: str):
+        """
+        Serve `pd.read_csv` and `pd.read_table` calls on files below `root_dir` from the cache.
+
+        Args:
+            root_dir (str): Directory of the sample's data files.
+        """
+        import pandas as pd
+        read_csv, read_table = pd.read_csv, pd.read_table
+        pd.read_csv = self._cached_reader('read_csv', read_csv, root_dir)
+        pd.read_table = self._cached_reader('read_table', read_table, root_dir)
+        try:
+            yield self
+        finally:
+            pd.read_csv, pd.read_table = read_csv, read_table
+
+
+def configure_dataframe_cache(max_mb: float):
+    """
+    Enable the DataFrame cache for code executed in this process.
+
+    Args:
+        max_mb (float): Maximum total memory of the cached frames in MB, or None to disable the cache.
+    """
+    global _dataframe_cache
+    _dataframe_cache = DataFrameCache(max_mb) if max_mb else None
+
+
+def get_dataframe_cache():
+    """Return the configured DataFrame cache, or None if it is disabled."""
+    return _dataframe_cache
+
+
+if __name__ == '__main__':
+    pass
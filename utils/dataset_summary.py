@@ -0,0 +1,109 @@
+import os
+import threading
+import pandas as pd
+from .fingerprint import content_hash
+
+# Statistical summaries built in this process, keyed by (path, size, mtime)
+_summaries = {}
+_summaries_lock = threading.Lock()
+
+_DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', '.cache', 'summaries')
+
+
+def describe_csv(file_path: str, chunked_threshold_mb: float = 256, chunksize: int = 100000) -> str:
+    """
+    Return `pd.read_csv(file_path).describe().to_string()`.
+
+    Files larger than `chunked_threshold_mb` are never loaded as a whole. A first pass over
+    chunks finds the numeric columns, and each of them is then read on its own, which gives
+    the same summary while holding only one column in memory.
+
+    Args:
+        file_path (str): Path to the CSV file.
+        chunked_threshold_mb (float): Size above which the file is summarized column by column.
+        chunksize (int): Number of rows per chunk of the first pass.
+
+    Returns:
+        str: The statistical summary of the dataset.
+    """
+    if os.path.getsize(file_path) <= chunked_threshold_mb * 1024 * 1024:
+        return pd.read_csv(file_path).describe().to_string()
+
+    columns, numeric_columns = None, None
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        chunk_numeric_columns = set(chunk.select_dtypes(include='number').columns)
+        if columns is None:
+            columns, numeric_columns = list(chunk.columns), chunk_numeric_columns
+        else:
+            numeric_columns &= chunk_numeric_columns
+    if not numeric_columns:
+        # describe() summarizes all columns of non-numeric datasets, which needs the whole file
+        return pd.read_csv(file_path).describe().to_string()
+
+    descriptions = [
+        pd.read_csv(file_path, usecols=[position]).iloc[:, 0].describe().rename(column)
+        for position, column in enumerate(columns) if column in numeric_columns
+    ]
+    return pd.concat(descriptions, axis=1).to_string()
+
+
+def get_summary(file_path: str, index_dir: str = _DEFAULT_INDEX_DIR) -> str:
+    """
+    Return the statistical summary of a CSV file from the summary index.
+
+    Summaries are stored in `index_dir` under the content hash of the file and the pandas
+    version (which determines the formatting), so each data file is parsed once no matter
+    how many questions or runs use it.
+
+    Args:
+        file_path (str): Path to the CSV file.
+        index_dir (str): Directory of the on-disk summary index.
+
+    Returns:
+        str: The output of `describe().to_string()` for the dataset.
+    """
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _summaries_lock:
+        if key in _summaries:
+            return _summaries[key]
+
+    index_file = os.path.join(index_dir, f'{content_hash(file_path)}_pandas-{pd.__version__}.txt')
+    if os.path.exists(index_file):
+        with open(index_file, 'r') as f:
+            summary = f.read()
+    else:
+        summary = describe_csv(file_path)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            temp_file = f'{index_file}.{os.getpid()}.tmp'
+            with open(temp_file, 'w') as f:
+                f.write(summary)
+            os.replace(temp_file, index_file)
+        except OSError:
+            pass
+
+    with _summaries_lock:
+        _summaries[key] = summary
+    return summary
+
+
+def build_summary_index(dataset, index_dir: str = _DEFAULT_INDEX_DIR) -> int:
+    """
+    Precompute the summaries of all data files of a dataset.
+
+    Returns:
+        int: Number of distinct data files.
+    """
+    file_paths = sorted({file_path for sample in dataset.sample_generator() for file_path in sample.file_paths})
+    for file_path in file_paths:
+        get_summary(file_path, index_dir=index_dir)
+    return len(file_paths)
+
+
+if __name__ == '__main__':
+    from .load_data import load_datasets
+    from .time_print import time_print
+
+    dataset = load_datasets(names=['QRData']).get_dataset('QRData')
+    time_print(f'Indexed summaries of {build_summary_index(dataset)} QRData files.')
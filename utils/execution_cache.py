@@ -0,0 +1,104 @@
+import os
+import hashlib
+import threading
+from .fingerprint import content_hash
+from .output_parser import extract_python_code
+
+# Suffixes that the agents append to the output of a code execution
+_REACH_LIMIT_MARKER = 'You cannot generate code anymore.'
+_LAST_CHANCE_MARKER = '\nYou have one last chance to regenerate'
+
+
+def normalize_observation(observation: str) -> str:
+    """
+    Convert an observation recorded by an agent into the output of a fresh execution tool.
+
+    Agents append tool-limit instructions to the output of the code, while the evaluation
+    executes every code with a new tool and cuts the output at the reach limit message.
+
+    Args:
+        observation (str): The observation of an agent step.
+
+    Returns:
+        str: The output the evaluation would obtain by executing the code again.
+    """
+    if observation.find(_LAST_CHANCE_MARKER) != -1:
+        observation = observation[:observation.find(_LAST_CHANCE_MARKER)]
+    if observation.find(_REACH_LIMIT_MARKER) != -1:
+        return observation[:observation.find(_REACH_LIMIT_MARKER)]
+    return observation + '\n'
+
+
+class ExecutionCache:
+    """
+    Outputs of code executions keyed by the code and the content of the data files it reads.
+
+    Args:
+        entries (dict): Execution outputs keyed by `key(code, file_paths)`.
+    """
+    def __init__(self):
+        self.entries = {}
+        # Content hashes of data files, keyed by (path, size, mtime)
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    def _file_hash(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        file_key = (file_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if file_key in self._file_hashes:
+                return self._file_hashes[file_key]
+        file_hash = content_hash(file_path)
+        with self._lock:
+            self._file_hashes[file_key] = file_hash
+        return file_hash
+
+    def key(self, code: str, file_paths) -> str:
+        """Hash the code together with the content of the data files."""
+        digest = hashlib.sha256(code.encode('utf-8'))
+        for file_path in sorted(file_paths):
+            try:
+                digest.update(f'\0{os.path.basename(file_path)}\0{self._file_hash(file_path)}'.encode('utf-8'))
+            except OSError:
+                digest.update(f'\0{os.path.basename(file_path)}\0missing'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, code: str, file_paths):
+        """Return the cached output of the code, or None."""
+        key = self.key(code, file_paths)
+        with self._lock:
+            return self.entries.get(key)
+
+    def put(self, code: str, file_paths, output: str):
+        key = self.key(code, file_paths)
+        with self._lock:
+            self.entries[key] = output
+
+    def add_results(self, dataset_results: dict, dataset) -> int:
+        """
+        Pre-populate the cache with the observations recorded in experiment results.
+
+        Args:
+            dataset_results (dict): Experiment results keyed by sample index.
+            dataset (Dataset): The dataset the results were obtained on.
+
+        Returns:
+            int: Number of recorded observations added.
+        """
+        added = 0
+        for idx, result in dataset_results.items():
+            if 'steps' not in result:
+                continue
+            file_paths = dataset.get_sample(int(idx)).file_paths
+            for step in result['steps']:
+                # Agents execute the code block of the action input
+                code = extract_python_code(step['action_input']) if step.get('action_input') else ''
+                if not code or step.get('observation') is None:
+                    continue
+                self.put(code, file_paths, normalize_observation(step['observation']))
+                added += 1
+        return added
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,41 @@
+import os
+import hashlib
+
+
+def list_files(directory: str):
+    """Return the sorted paths of all files below `directory`."""
+    file_paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        file_paths.extend(os.path.join(root, file_name) for file_name in sorted(files))
+    return file_paths
+
+
+def stat_fingerprint(file_paths) -> str:
+    """
+    Hash the paths, sizes and modification times of files.
+
+    The fingerprint changes whenever one of the files is added, removed or rewritten,
+    without reading their content.
+    """
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            digest.update(f'{file_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+        except OSError:
+            digest.update(f'{file_path}\0missing\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash the content of a file, reading it in chunks of `chunk_size` bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+if __name__ == '__main__':
+    pass
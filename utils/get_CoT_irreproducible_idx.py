@@ -8,12 +8,13 @@ from .load_data import load_datasets
 import os
 import sys
 
-def get_irreproducible_idx(model_name, dataset_name, agent_type):
+def get_irreproducible_idx(model_name, dataset_name, agent_type, dataset=None):
     results = load_results(model_name, dataset_name, agent_type)
     indices = np.arange(len(results['reproducibility_scores']))
     if dataset_name == 'StatQA':
-        collection = load_datasets()
-        dataset = collection.get_dataset('StatQA')
+        # Reuse the caller's dataset instead of loading it again
+        if dataset is None:
+            dataset = load_datasets(names=['StatQA']).get_dataset('StatQA')
         indices = np.array(sorted(list(sample_StatQA(dataset))))
     irreproducible_idx = indices[np.array(results['reproducibility_scores'])!=1]
     print('Found', len(irreproducible_idx), 'irreproducible samples.')
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from .time_print import time_print
+
+_llm_cache = None
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache of chat model responses.
+
+    Entries are evicted in least-recently-used order once the cached content exceeds
+    `max_size_mb`. The database can be shared by several processes.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024):
+        """
+        Args:
+            path (str): Path to the SQLite database file.
+            max_size_mb (float): Maximum size of the cached responses in MB.
+        """
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, content TEXT, usage_metadata TEXT, size INTEGER, last_access REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+    def get(self, key: str):
+        """
+        Look up a response.
+
+        Returns:
+            tuple: `(content, usage_metadata)`, or None if the key is not cached.
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT content, usage_metadata FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, content: str, usage_metadata: dict):
+        """Store a response and evict the least recently used ones if the cache is full."""
+        usage_metadata = json.dumps(usage_metadata)
+        size = len(content.encode('utf-8')) + len(usage_metadata)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, content, usage_metadata, size, time.time()))
+            total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size:
+                # Evict down to 90% of the limit so that eviction does not run on every insert
+                excess = total_size - int(self.max_size * 0.9)
+                evicted = []
+                for old_key, old_size in self._connection.execute(
+                        "SELECT key, size FROM responses ORDER BY last_access"):
+                    if excess <= 0:
+                        break
+                    evicted.append((old_key,))
+                    excess -= old_size
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+def _message_to_list(message):
+    if isinstance(message, BaseMessage):
+        return [message.type, message.content]
+    return list(message)
+
+
+class CachedChatModel:
+    """
+    Chat model wrapper that answers repeated requests from an `LLMCache`.
+
+    Requests are keyed by provider, model id, generation parameters and the full message
+    list. Attributes other than `invoke`/`ainvoke`/`stream` are forwarded to the wrapped model.
+    """
+
+    def __init__(self, llm, cache: LLMCache, provider: str, model_id: str):
+        """
+        Args:
+            llm: The LangChain chat model to wrap.
+            cache (LLMCache): The response cache.
+            provider (str): Model type of the configuration, e.g. 'openai' or 'meta'.
+            model_id (str): Model name or deployment of the provider.
+        """
+        self.llm = llm
+        self.cache = cache
+        self.provider = provider
+        self.model_id = model_id
+        self.params = json.dumps(llm._identifying_params, sort_keys=True, default=str)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _key(self, messages, kwargs) -> str:
+        request = json.dumps({
+            "provider": self.provider,
+            "model_id": self.model_id,
+            "params": self.params,
+            "kwargs": kwargs,
+            "messages": [_message_to_list(message) for message in messages],
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def _lookup(self, key):
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        content, usage_metadata = cached
+        return AIMessage(content=content, usage_metadata=usage_metadata, response_metadata={"cache_hit": True})
+
+    def invoke(self, messages, **kwargs):
+        key = self._key(messages, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = self.llm.invoke(messages, **kwargs)
+            self.cache.put(key, response.content, response.usage_metadata)
+        return response
+
+    async def ainvoke(self, messages, **kwargs):
+        key = self._key(messages, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = await self.llm.ainvoke(messages, **kwargs)
+            self.cache.put(key, response.content, response.usage_metadata)
+        return response
+
+    def stream(self, messages, **kwargs):
+        """Stream the response; only streams read to the end are cached, a hit is one chunk."""
+        key = self._key(messages, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            content, usage_metadata = cached
+            yield AIMessageChunk(content=content, usage_metadata=usage_metadata, response_metadata={"cache_hit": True})
+            return
+        merged = None
+        for chunk in self.llm.stream(messages, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self.cache.put(key, merged.content, merged.usage_metadata)
+
+
+def configure_llm_cache(path: str, max_size_mb: float = 1024):
+    """
+    Enable the response cache for all chat models created afterwards.
+
+    Args:
+        path (str): Path to the SQLite database file, or None to disable the cache.
+        max_size_mb (float): Maximum size of the cached responses in MB.
+    """
+    global _llm_cache
+    _llm_cache = LLMCache(path, max_size_mb) if path else None
+
+
+def _temperature(llm):
+    """Sampling temperature of a chat model, or None if it does not declare one."""
+    temperature = getattr(llm, 'temperature', None)
+    if temperature is None:
+        # ChatBedrock passes it in the model arguments
+        temperature = (getattr(llm, 'model_kwargs', None) or {}).get('temperature')
+    return temperature
+
+
+def with_llm_cache(llm, provider: str, model_id: str):
+    """
+    Wrap `llm` in a `CachedChatModel` if the response cache is enabled.
+
+    Only models sampling at temperature 0 are cached. Others, like o3-mini which only supports a
+    temperature of 1, are returned unwrapped, as a cached response would stand in for every sample.
+    """
+    if _llm_cache is None:
+        return llm
+    if _temperature(llm) != 0:
+        time_print(f'Responses of {model_id} are not cached, as its temperature is not 0.')
+        return llm
+    return CachedChatModel(llm, _llm_cache, provider, model_id)
+
+
+if __name__ == '__main__':
+    pass
@@ -2,13 +2,13 @@ import pandas as pd
 import json
 import os
 import copy
+import glob
+import pickle
 from .data_class import DataSample, Dataset, DatasetCollection
+from .fingerprint import list_files, stat_fingerprint
 from .time_print import time_print
 
-def load_datasets():
-    current_path = os.path.abspath(__file__)
-    data_path = '/'.join(current_path.split('/')[:-2])+'/data/'
-
+def _load_qrdata(data_path):
     ### QRData
     with open(data_path+'QRData/QRData.json', 'r') as f:
         QRData = json.load(f)
@@ -24,9 +24,10 @@ def load_datasets():
                                 question_type=sample['meta_data']['question_type'])
         data_samples.append(data_sample)
     QRData_dataset = Dataset(name='QRData', samples=data_samples, description=f"This is QRData")
+    return QRData_dataset
 
 
-
+def _load_statqa(data_path):
     ### StatQA
     dataset_metadata = pd.read_csv(data_path+'StatQA/dataset_metadata.csv')
     dataset_to_description = {}
@@ -85,9 +86,10 @@ def load_datasets():
                                 )
         data_samples.append(data_sample)
     StatQA_dataset = Dataset(name='StatQA', samples=data_samples, description=f"This is StatQA")
+    return StatQA_dataset
 
 
-
+def _load_discoverybench(data_path):
     ### DiscoveryBench
     id_to_metadata = {}
     for subject_name in os.listdir(data_path+'DiscoveryBench'):
@@ -134,10 +136,94 @@ def load_datasets():
                                 )
         data_samples.append(data_sample)
     DiscoveryBench_dataset = Dataset(name='DiscoveryBench', samples=data_samples, description=f"This is DiscoveryBench")
+    return DiscoveryBench_dataset
+
+
+DATASET_LOADERS = {
+    'QRData': _load_qrdata,
+    'StatQA': _load_statqa,
+    'DiscoveryBench': _load_discoverybench,
+}
+
+# Files parsed by each loader. Data files are only referenced by path, and generated code writes
+# its outputs next to them, so they are left out of the cache key.
+DATASET_INPUTS = {
+    'QRData': lambda data_path: [data_path+'QRData/QRData.json'],
+    'StatQA': lambda data_path: [data_path+'StatQA/dataset_metadata.csv', data_path+'StatQA/mini-StatQA.json']
+                                + list_files(data_path+'StatQA/column_metadata'),
+    'DiscoveryBench': lambda data_path: [data_path+'DiscoveryBench/answer_key_real.csv']
+                                        + sorted(glob.glob(data_path+'DiscoveryBench/*/*.json')),
+}
+
+
+def _load_cached(name, data_path):
+    """
+    Load a dataset from the binary cache in `data/.cache`, parsing and caching it on a miss.
+
+    The cache key covers the paths, sizes and modification times of the files the loader parses
+    and of the parsing code, so the cache is invalidated whenever either changes, but not by
+    files that generated code writes into the data folders.
+    """
+    code_files = [os.path.abspath(__file__), os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_class.py')]
+    fingerprint = stat_fingerprint(DATASET_INPUTS[name](data_path) + code_files)
+    cache_dir = data_path+'.cache'
+    cache_file = os.path.join(cache_dir, f'{name}_{fingerprint[:16]}.pkl')
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # Unreadable cache files are rebuilt below
+            pass
+
+    dataset = DATASET_LOADERS[name](data_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_cache_file in glob.glob(os.path.join(cache_dir, f'{name}_*.pkl')):
+            os.remove(old_cache_file)
+        temp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as f:
+            pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        time_print(f'Could not cache the {name} dataset: {e}')
+    return dataset
+
+
+def load_datasets(names=None, use_cache=True):
+    """
+    Create a collection of the benchmark datasets.
+
+    Datasets are parsed on their first `get_dataset()` access, so commands that work on one
+    dataset do not pay for loading the others. Parsed datasets are cached on disk until the
+    raw data changes.
+
+    Args:
+        names (list): Names of the datasets to include. Defaults to all datasets.
+        use_cache (bool): Whether to read and write the on-disk cache of parsed datasets.
+
+    Returns:
+        DatasetCollection: The collection of datasets.
+    """
+    current_path = os.path.abspath(__file__)
+    data_path = '/'.join(current_path.split('/')[:-2])+'/data/'
+
+    if names is None:
+        names = list(DATASET_LOADERS)
+    collection = DatasetCollection(names=[], datasets=[])
+    for name in names:
+        if name not in DATASET_LOADERS:
+            raise ValueError(f"Unknown dataset '{name}'. Choose from {', '.join(DATASET_LOADERS)}.")
 
-    collection = DatasetCollection(names=['QRData', 'StatQA', 'DiscoveryBench'], 
-                                   datasets=[QRData_dataset, StatQA_dataset, DiscoveryBench_dataset])
-    time_print('Loaded QRData, StatQA, and DiscoveryBench datasets.')
+        def loader(name=name):
+            if use_cache:
+                dataset = _load_cached(name, data_path)
+            else:
+                dataset = DATASET_LOADERS[name](data_path)
+            time_print(f'Loaded {name} dataset.')
+            return dataset
+        collection.add_loader(name, loader)
     return collection
 
 if __name__ == '__main__':
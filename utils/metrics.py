@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from .tracing import span
+
+
+def percentile(values, q: float) -> float:
+    """Return the `q`-th percentile (0-100) of `values` by the nearest-rank method."""
+    ordered = sorted(values)
+    rank = max(1, int(-(-q * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+
+def _distribution(values) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+class MetricsRecorder:
+    """
+    Latency, throughput and token usage of the stages of a run.
+
+    Stages are timed with `timer`. A stage that calls a model stores the response's
+    `usage_metadata` (and, for streamed calls, the seconds until the first token as `ttft`)
+    in the dictionary yielded by the timer.
+
+    Args:
+        labels (dict): Labels of the run, e.g. the model, dataset and agent type.
+        durations (dict): Seconds of every timed call, keyed by stage.
+        ttfts (dict): Seconds until the first token of streamed calls, keyed by stage.
+        tokens (dict): Input and output tokens, keyed by stage.
+        samples (int): Number of finished samples.
+    """
+    def __init__(self, labels: dict = None):
+        self.labels = labels or {}
+        self.durations = defaultdict(list)
+        self.ttfts = defaultdict(list)
+        self.tokens = defaultdict(lambda: {"input_tokens": 0, "output_tokens": 0})
+        self.samples = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time the enclosed block as one call of `stage`, which is also traced as a span."""
+        record = {}
+        start = time.perf_counter()
+        with span(stage) as span_args:
+            try:
+                yield record
+            finally:
+                self.record(stage, time.perf_counter() - start, **record)
+                if record.get('usage_metadata'):
+                    span_args.update(
+                        input_tokens=record['usage_metadata'].get('input_tokens', 0),
+                        output_tokens=record['usage_metadata'].get('output_tokens', 0))
+
+    def record(self, stage: str, seconds: float, usage_metadata: dict = None, ttft: float = None):
+        with self._lock:
+            self.durations[stage].append(seconds)
+            if ttft is not None:
+                self.ttfts[stage].append(ttft)
+            if usage_metadata:
+                self.tokens[stage]["input_tokens"] += usage_metadata.get('input_tokens', 0)
+                self.tokens[stage]["output_tokens"] += usage_metadata.get('output_tokens', 0)
+
+    def count_sample(self):
+        with self._lock:
+            self.samples += 1
+
+    def summary(self) -> dict:
+        """Summarize the stages recorded so far."""
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            stages = {}
+            for stage, durations in self.durations.items():
+                stages[stage] = {"seconds": _distribution(durations), "total_seconds": sum(durations)}
+                if self.ttfts.get(stage):
+                    stages[stage]["time_to_first_token"] = _distribution(self.ttfts[stage])
+                if stage in self.tokens:
+                    tokens = dict(self.tokens[stage])
+                    tokens["output_tokens_per_second"] = tokens["output_tokens"] / max(sum(durations), 1e-9)
+                    stages[stage]["tokens"] = tokens
+            total_tokens = sum(t["input_tokens"] + t["output_tokens"] for t in self.tokens.values())
+            return {
+                "labels": self.labels,
+                "started": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                "elapsed_seconds": elapsed,
+                "samples": self.samples,
+                "samples_per_minute": self.samples * 60 / elapsed,
+                "tokens_per_second": total_tokens / elapsed,
+                "stages": stages,
+            }
+
+    def dump(self, path: str):
+        """Write the summary to `path` atomically."""
+        summary = self.summary()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+_metrics = MetricsRecorder()
+_metrics_path = None
+_stop_dumping = threading.Event()
+
+
+def configure_metrics(path: str, labels: dict = None, interval: float = 60):
+    """
+    Start recording the metrics of a run and dump them to `path` every `interval` seconds.
+
+    Args:
+        path (str): Path to the metrics JSON file, or None to keep the metrics in memory only.
+        labels (dict): Labels of the run, e.g. the model, dataset and agent type.
+        interval (float): Seconds between two periodic dumps.
+    """
+    global _metrics, _metrics_path, _stop_dumping
+    _stop_dumping.set()
+    _metrics = recorder = MetricsRecorder(labels)
+    _metrics_path = path
+    _stop_dumping = stop = threading.Event()
+    if path and interval:
+        def dump_periodically():
+            while not stop.wait(interval):
+                recorder.dump(path)
+        threading.Thread(target=dump_periodically, daemon=True).start()
+
+
+def finish_metrics():
+    """Stop the periodic dumps and write the final metrics."""
+    _stop_dumping.set()
+    if _metrics_path:
+        _metrics.dump(_metrics_path)
+
+
+def get_metrics() -> MetricsRecorder:
+    return _metrics
+
+
+def timer(stage: str):
+    """Time the enclosed block as one call of `stage` in the metrics of the run."""
+    return _metrics.timer(stage)
+
+
+if __name__ == '__main__':
+    pass
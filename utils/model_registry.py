@@ -0,0 +1,118 @@
+import json
+import threading
+from .llm_cache import with_llm_cache
+from .rate_limiter import with_rate_limit
+
+# Chat model clients shared by all agents and evaluators, keyed by (provider, model, params)
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Builds chat models instead of the provider SDKs when set, e.g. to replay recorded outputs offline
+_chat_model_factory = None
+
+_http_pool = {"max_connections": 32, "keepalive_expiry": 60.0}
+_http_client = None
+
+
+def configure_http_pool(max_connections: int = 32, keepalive_expiry: float = 60.0):
+    """
+    Set the connection pool of clients created afterwards.
+
+    Args:
+        max_connections (int): Maximum number of open connections per provider client.
+        keepalive_expiry (float): Seconds an idle connection is kept alive for reuse.
+    """
+    global _http_client
+    with _clients_lock:
+        _http_pool.update(max_connections=max_connections, keepalive_expiry=keepalive_expiry)
+        _http_client = None
+
+
+def set_chat_model_factory(factory):
+    """
+    Create chat models with `factory` instead of the provider SDKs.
+
+    Args:
+        factory (callable): Called as `factory(model_type, model_name)` for every requested
+            model, or None to create provider clients again.
+    """
+    global _chat_model_factory
+    with _clients_lock:
+        _chat_model_factory = factory
+        _clients.clear()
+
+
+def _http_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=_http_pool["max_connections"],
+        max_keepalive_connections=_http_pool["max_connections"],
+        keepalive_expiry=_http_pool["keepalive_expiry"])
+
+
+def _get_http_client():
+    """The keep-alive HTTP client shared by all OpenAI clients."""
+    global _http_client
+    if _http_client is None:
+        import openai
+        _http_client = openai.DefaultHttpxClient(limits=_http_limits())
+    return _http_client
+
+
+def _build_chat_model(model_type, model_name, base_url, temperature, overrides):
+    # Provider SDKs are imported on first use, so a run only loads the one it talks to.
+    # Their own retries are disabled: the rate limiter is the only layer retrying and backing off.
+    if model_type == 'deepseek':
+        from langchain_ollama import ChatOllama
+        params = dict(model=model_name, base_url=base_url, temperature=temperature, num_ctx=8196*2, num_predict=6000)
+        return ChatOllama(**{**params, **overrides}, client_kwargs={"limits": _http_limits()})
+    elif model_type.startswith('meta'):
+        from langchain_ollama import ChatOllama
+        params = dict(model=model_name, base_url=base_url, temperature=temperature, repetition_penalty=1.18, num_ctx=8196*2, num_predict=2048)
+        return ChatOllama(**{**params, **overrides}, client_kwargs={"limits": _http_limits()})
+    elif model_type == 'anthropic':
+        from botocore.config import Config
+        from langchain_aws import ChatBedrock
+        params = dict(model_id=model_name, model_kwargs=dict(temperature=temperature), region_name='us-east-1', max_tokens=2048)
+        config = Config(max_pool_connections=_http_pool["max_connections"], tcp_keepalive=True, retries={"total_max_attempts": 1})
+        return ChatBedrock(**{**params, **overrides}, config=config)
+    elif model_type == 'openai':
+        from langchain_openai import AzureChatOpenAI
+        params = dict(azure_deployment=model_name, api_version="2024-10-01-preview", temperature=temperature, max_tokens=2048, max_retries=0)
+        # stream_usage: streamed responses end with a chunk reporting the token usage
+        return AzureChatOpenAI(**{**params, **overrides}, http_client=_get_http_client(), stream_usage=True)
+    elif model_type == 'openai-o':
+        from langchain_openai import AzureChatOpenAI
+        params = dict(azure_deployment='o3-mini-2025-01-31', api_version="2024-12-01-preview", temperature=1, reasoning_effort='low', max_completion_tokens=4000, max_retries=0)
+        return AzureChatOpenAI(**{**params, **overrides}, http_client=_get_http_client(), stream_usage=True)
+    else:
+        raise ValueError(f"Unsupported model type: {model_type}")
+
+
+def get_chat_model(model_type: str, model_name: str, base_url: str = '', temperature: float = 0, **overrides):
+    """
+    Return the shared chat model client of a configuration, creating it on first use.
+
+    Args:
+        model_type (str): Provider family from `model_config.json`, e.g. 'openai' or 'meta'.
+        model_name (str): Model name or deployment.
+        base_url (str): Host of the Ollama server for 'meta' and 'deepseek' models.
+        temperature (float): Sampling temperature.
+        **overrides: Client parameters replacing the defaults of the provider.
+
+    Returns:
+        object: The chat model behind the rate limiter of its provider, wrapped by the response
+            cache if it is enabled so that cached responses are not rate limited.
+    """
+    if _chat_model_factory is not None:
+        return _chat_model_factory(model_type, model_name)
+    key = (model_type, model_name, base_url, temperature, json.dumps(overrides, sort_keys=True, default=str))
+    with _clients_lock:
+        if key not in _clients:
+            llm = with_rate_limit(_build_chat_model(model_type, model_name, base_url, temperature, overrides), model_type)
+            _clients[key] = with_llm_cache(llm, provider=model_type, model_id=model_name)
+        return _clients[key]
+
+
+if __name__ == '__main__':
+    pass
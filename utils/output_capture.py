@@ -0,0 +1,164 @@
+import io
+import os
+import sys
+import time
+import codecs
+import ctypes
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+
+_output_capture = {"max_bytes": None, "max_lines_per_second": None, "capture_fds": False}
+
+# Size of the reads of the file that captured file descriptor output
+_READ_SIZE = 1 << 16
+
+
+def configure_output_capture(max_bytes: int = None, max_lines_per_second: float = None, capture_fds: bool = False):
+    """
+    Bound the output captured from generated code.
+
+    Args:
+        max_bytes (int): Maximum size of an observation in UTF-8 bytes. The first and last
+            halves are kept around an elision marker. None keeps everything.
+        max_lines_per_second (float): Lines kept per second of execution; lines printed
+            faster are dropped and counted in a marker. None keeps every line.
+        capture_fds (bool): Whether output written to file descriptors 1 and 2 (C extensions,
+            subprocesses, `sys.__stdout__`) is captured too. This redirects the descriptors of
+            the whole process, so it is only used by sandbox workers.
+    """
+    global _output_capture
+    _output_capture = {"max_bytes": max_bytes, "max_lines_per_second": max_lines_per_second, "capture_fds": capture_fds}
+
+
+def get_output_capture() -> dict:
+    """Return the arguments of the current `configure_output_capture` call."""
+    return dict(_output_capture)
+
+
+class BoundedOutput(io.TextIOBase):
+    """
+    Text stream keeping the head and tail of what is written to it.
+
+    Without limits it keeps everything, like `io.StringIO`.
+
+    Args:
+        head (list): Strings written while the head had room.
+        tail (deque): UTF-8 encoded writes after the head, the oldest dropped once the rest
+            fills the tail.
+        elided_bytes (int): Bytes dropped from the tail.
+        dropped_lines (int): Lines dropped by the rate limit since the last marker.
+    """
+    def __init__(self, max_bytes: int = None, max_lines_per_second: float = None):
+        self.max_bytes = max_bytes
+        self.head_limit = max_bytes // 2 if max_bytes else None
+        self.tail_limit = max_bytes - self.head_limit if max_bytes else None
+        self.head, self.head_bytes = [], 0
+        self.tail, self.tail_bytes = deque(), 0
+        self.elided_bytes = 0
+        self.max_lines_per_second = max_lines_per_second
+        self.window_start = time.monotonic()
+        self.window_lines = 0
+        self.dropped_lines = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text: str) -> int:
+        """Write `text`, unless the rate limit drops it."""
+        if self.max_lines_per_second:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_lines = now, 0
+                self._flush_dropped_lines()
+            if self.window_lines >= self.max_lines_per_second:
+                self.dropped_lines += text.count('\n')
+                return len(text)
+            self.window_lines += text.count('\n')
+        self.append(text)
+        return len(text)
+
+    def _flush_dropped_lines(self):
+        if self.dropped_lines:
+            dropped_lines, self.dropped_lines = self.dropped_lines, 0
+            self.append(f"... [{dropped_lines} lines dropped] ...\n")
+
+    def append(self, text: str):
+        """Add `text` within the byte cap, bypassing the rate limit."""
+        if self.max_bytes is None:
+            self.head.append(text)
+            return
+        data = text.encode('utf-8', 'replace')
+        room = self.head_limit - self.head_bytes
+        if room > 0:
+            part, data = data[:room], data[room:]
+            self.head.append(part.decode('utf-8', 'ignore'))
+            self.head_bytes += len(part)
+        if data:
+            self.tail.append(data)
+            self.tail_bytes += len(data)
+            while self.tail_bytes - len(self.tail[0]) >= self.tail_limit:
+                dropped = self.tail.popleft()
+                self.tail_bytes -= len(dropped)
+                self.elided_bytes += len(dropped)
+
+    def getvalue(self) -> str:
+        """The captured output, with a marker where bytes were elided."""
+        self._flush_dropped_lines()
+        head = ''.join(self.head)
+        if self.max_bytes is None:
+            return head
+        tail = b''.join(self.tail)
+        excess = max(0, len(tail) - self.tail_limit)
+        tail = tail[excess:].decode('utf-8', 'ignore')
+        if self.elided_bytes + excess:
+            return f"{head}\n... [{self.elided_bytes + excess} bytes elided] ...\n{tail}"
+        return head + tail
+
+
+def _flush_c_stdio():
+    """Flush the buffers of C `stdout`/`stderr`, which are not flushed by Python."""
+    try:
+        ctypes.CDLL(None).fflush(None)
+    except (OSError, AttributeError):
+        pass
+
+
+@contextmanager
+def capture_fd_output(stream: BoundedOutput):
+    """
+    Capture what is written to file descriptors 1 and 2 in the enclosed block into `stream`.
+
+    The output is spooled to a temporary file and added after the block, so it follows the
+    Python-level output of the block in the observation.
+    """
+    for python_stream in (sys.__stdout__, sys.__stderr__):
+        if python_stream is not None:
+            python_stream.flush()
+    _flush_c_stdio()
+    saved_fds = [os.dup(1), os.dup(2)]
+    with tempfile.TemporaryFile() as spool:
+        os.dup2(spool.fileno(), 1)
+        os.dup2(spool.fileno(), 2)
+        try:
+            yield stream
+        finally:
+            for python_stream in (sys.__stdout__, sys.__stderr__):
+                if python_stream is not None:
+                    python_stream.flush()
+            _flush_c_stdio()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            spool.seek(0)
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            while True:
+                data = spool.read(_READ_SIZE)
+                stream.append(decoder.decode(data, final=not data))
+                if not data:
+                    break
+
+
+if __name__ == '__main__':
+    pass
@@ -1,4 +1,5 @@
 from .data_class import DataSample
+from .dataset_summary import get_summary
 import os
 import pandas as pd
 import pdb
@@ -54,9 +55,8 @@ def prepare_qrdata_prompt(sample):
     #    descriptions += ', '.join(dataset.columns) + '\n'
 
     for file_path in sample.file_paths:
-        dataset = pd.read_csv(file_path)
         descriptions += 'Below is a statistical summary of the dataset '+os.path.basename(file_path)+':\n'
-        descriptions += dataset.describe().to_string() + '\n'
+        descriptions += get_summary(file_path) + '\n'
 
     return {
         "file_paths": file_paths,
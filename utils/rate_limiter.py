@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from .time_print import time_print
+
+# Fragments of the error messages of throttled requests (Azure OpenAI, Bedrock, Ollama)
+_THROTTLING_MARKERS = ('throttling', 'toomanyrequests', 'too many requests', 'rate limit')
+
+_rate_limit_config = {}
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether `error` reports a throttled request rather than a failed one."""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code', '')
+        if code in ('ThrottlingException', 'TooManyRequestsException'):
+            return True
+    message = str(error).lower()
+    return any(marker in message for marker in _THROTTLING_MARKERS)
+
+
+def _retry_after(error: Exception):
+    """The delay in seconds requested by the `Retry-After` header of a throttled response, if any."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages) -> int:
+    """Estimate the prompt tokens of a message list at four characters per token."""
+    characters = 0
+    for message in messages:
+        content = message.content if hasattr(message, 'content') else message[1]
+        characters += len(content) if isinstance(content, str) else len(json.dumps(content, default=str))
+    return characters // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute.
+
+    Args:
+        capacity (float): Maximum number of tokens, one minute worth of refill.
+        level (float): Available tokens; negative after requests used more than estimated.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float):
+        """Block until `amount` tokens are available and take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Take `amount` more tokens (or return them if negative) once the actual usage is known."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """
+    Limits shared by all requests to one provider.
+
+    Requests wait for the requests-per-minute and tokens-per-minute buckets and for a slot of
+    the concurrency window. The window grows by one slot per window of successful requests and
+    is halved whenever the provider throttles a request (AIMD), which keeps the number of
+    requests in flight close to the highest rate the provider sustains. Throttled requests are
+    retried after an exponential backoff with full jitter.
+    """
+    def __init__(self, provider: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrency: int = 64, max_retries: int = 8, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Args:
+            provider (str): Model type of the configuration, e.g. 'openai' or 'anthropic'.
+            requests_per_minute (float): Request quota, or None for unlimited.
+            tokens_per_minute (float): Token quota, or None for unlimited.
+            max_concurrency (int): Upper bound of the concurrency window.
+            max_retries (int): Number of retries of a throttled request before the error is raised.
+            base_delay (float): Backoff in seconds of the first retry.
+            max_delay (float): Maximum backoff in seconds.
+        """
+        self.provider = provider
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency or 64
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.concurrency_limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def _enter(self):
+        with self._condition:
+            while self.in_flight >= max(1, int(self.concurrency_limit)):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _exit(self, throttled: bool = False, succeeded: bool = True):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            elif succeeded:
+                self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            self._condition.notify_all()
+
+    def call(self, func, estimated_tokens: int = 0):
+        """
+        Call `func` within the limits of the provider.
+
+        Args:
+            func (callable): Function sending one request and returning the model response.
+            estimated_tokens (int): Tokens taken from the token bucket before the request. The
+                bucket is corrected with the `usage_metadata` of the response.
+
+        Returns:
+            The response of `func`.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                self.request_bucket.acquire(1)
+            if self.token_bucket:
+                self.token_bucket.acquire(estimated_tokens)
+            self._enter()
+            try:
+                response = func()
+            except Exception as error:
+                throttled = is_rate_limit_error(error)
+                self._exit(throttled=throttled, succeeded=False)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(error) or 0)
+                time_print(f'{self.provider} throttled a request, retrying in {delay:.1f}s '
+                           f'(concurrency limit {int(self.concurrency_limit)}).')
+                time.sleep(delay)
+                continue
+            self._exit()
+            usage_metadata = getattr(response, 'usage_metadata', None)
+            if self.token_bucket and usage_metadata:
+                used = usage_metadata.get('total_tokens') or usage_metadata['input_tokens'] + usage_metadata['output_tokens']
+                self.token_bucket.adjust(used - estimated_tokens)
+            return response
+
+    def stream(self, func, estimated_tokens: int = 0):
+        """
+        Iterate the chunks of a streamed response within the limits of the provider.
+
+        The request holds its concurrency slot until the stream is exhausted or closed. It is
+        only retried if it was throttled before its first chunk.
+
+        Args:
+            func (callable): Function sending one request and returning an iterator of chunks.
+            estimated_tokens (int): Tokens taken from the token bucket before the request.
+
+        Yields:
+            The chunks of the response.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.request_bucket:
+                self.request_bucket.acquire(1)
+            if self.token_bucket:
+                self.token_bucket.acquire(estimated_tokens)
+            self._enter()
+            outcome, started, usage_metadata = 'error', False, None
+            try:
+                for chunk in func():
+                    started = True
+                    usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+                    yield chunk
+                outcome = 'ok'
+            except GeneratorExit:
+                # The consumer stopped reading, e.g. after an early termination
+                outcome = 'ok'
+                raise
+            except Exception as error:
+                if started or not is_rate_limit_error(error) or attempt == self.max_retries:
+                    raise
+                outcome = 'throttled'
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                delay = max(delay, _retry_after(error) or 0)
+            finally:
+                self._exit(throttled=outcome == 'throttled', succeeded=outcome == 'ok')
+                if outcome == 'ok' and self.token_bucket and usage_metadata:
+                    used = usage_metadata.get('total_tokens') or usage_metadata['input_tokens'] + usage_metadata['output_tokens']
+                    self.token_bucket.adjust(used - estimated_tokens)
+            if outcome == 'ok':
+                return
+            time_print(f'{self.provider} throttled a request, retrying in {delay:.1f}s '
+                       f'(concurrency limit {int(self.concurrency_limit)}).')
+            time.sleep(delay)
+
+
+class RateLimitedChatModel:
+    """
+    Chat model wrapper sending every request through the `RateLimiter` of its provider.
+
+    Attributes other than `invoke`/`ainvoke`/`stream` are forwarded to the wrapped model.
+    """
+    def __init__(self, llm, limiter: RateLimiter):
+        self.llm = llm
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def invoke(self, messages, **kwargs):
+        return self.limiter.call(lambda: self.llm.invoke(messages, **kwargs), estimate_tokens(messages))
+
+    async def ainvoke(self, messages, **kwargs):
+        # The limiter blocks, so asynchronous callers wait for it in a thread
+        return await asyncio.to_thread(self.invoke, messages, **kwargs)
+
+    def stream(self, messages, **kwargs):
+        return self.limiter.stream(lambda: self.llm.stream(messages, **kwargs), estimate_tokens(messages))
+
+
+def configure_rate_limits(config_path: str):
+    """
+    Load the limits of each provider from a JSON file.
+
+    The file maps model types to `requests_per_minute`, `tokens_per_minute` and
+    `max_concurrency`, where null means unlimited. Providers missing from the file
+    are only protected by the concurrency window and the retries.
+
+    Args:
+        config_path (str): Path to the configuration file; ignored if it does not exist.
+    """
+    global _rate_limit_config
+    with _limiters_lock:
+        _rate_limit_config = {}
+        if config_path and os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                _rate_limit_config = json.load(f)
+        _limiters.clear()
+
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    """Return the limiter shared by all clients of `provider`."""
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(provider, **_rate_limit_config.get(provider, {}))
+        return _limiters[provider]
+
+
+def with_rate_limit(llm, provider: str):
+    """Wrap `llm` in a `RateLimitedChatModel` using the limiter of `provider`."""
+    return RateLimitedChatModel(llm, get_rate_limiter(provider))
+
+
+if __name__ == '__main__':
+    pass
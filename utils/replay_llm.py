@@ -0,0 +1,161 @@
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+def _estimate_usage(prompt: str, content: str) -> dict:
+    input_tokens, output_tokens = len(prompt) // 4 + 1, len(content) // 4 + 1
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+
+def _message_content(message) -> str:
+    return message.content if hasattr(message, 'content') else message[1]
+
+
+class LatencyModel:
+    """
+    Lognormal latency with a given median and 95th percentile.
+
+    Args:
+        mu (float): Mean of the logarithm of the latency.
+        sigma (float): Standard deviation of the logarithm of the latency.
+    """
+    def __init__(self, p50: float, p95: float):
+        p50 = max(p50, 1e-6)
+        self.mu = math.log(p50)
+        self.sigma = max(math.log(max(p95, p50) / p50), 0) / 1.6449
+
+    @classmethod
+    def from_metrics(cls, metrics_path: str, stage: str = 'llm_call'):
+        """Fit the latency of `stage` in a metrics file written by `utils.metrics`."""
+        with open(metrics_path, 'r') as f:
+            seconds = json.load(f)['stages'][stage]['seconds']
+        return cls(seconds['p50'], seconds['p95'])
+
+    def sample(self) -> float:
+        return random.lognormvariate(self.mu, self.sigma)
+
+
+class ReplayChatModel:
+    """
+    Chat model answering with the LLM outputs recorded in the steps of an experiment result.
+
+    The n-th call returns the `content` and `usage_metadata` of the n-th recorded step. Calls
+    beyond the recording return an empty message, which ends the agent run at the parser.
+
+    Args:
+        outputs (list): Recorded (content, usage_metadata) pairs.
+        prompts (list): Prompts of the calls received so far.
+    """
+    def __init__(self, steps: list, latency: LatencyModel = None):
+        """
+        Args:
+            steps (list): The `steps` of a sample in `results/{model}_{dataset}_{agent}.json`.
+            latency (LatencyModel): Latency added to every call, or None to answer at once.
+        """
+        self.outputs = [(step.get('content') or '', step.get('usage_metadata')) for step in steps]
+        self.latency = latency
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether the agent asked for more outputs than were recorded."""
+        return len(self.prompts) > len(self.outputs)
+
+    def invoke(self, messages, **kwargs):
+        prompt = '\n'.join(_message_content(message) for message in messages)
+        with self._lock:
+            position = len(self.prompts)
+            self.prompts.append(prompt)
+        if self.latency:
+            time.sleep(self.latency.sample())
+        if position >= len(self.outputs):
+            return AIMessage(content='', usage_metadata=_estimate_usage(prompt, ''), response_metadata={"replayed": False})
+        content, usage_metadata = self.outputs[position]
+        return AIMessage(content=content, usage_metadata=usage_metadata or _estimate_usage(prompt, content),
+                         response_metadata={"replayed": True})
+
+    async def ainvoke(self, messages, **kwargs):
+        return await asyncio.to_thread(self.invoke, messages, **kwargs)
+
+    def stream(self, messages, chunk_size: int = 64, **kwargs):
+        """Stream the output of `invoke` in chunks of `chunk_size` characters, usage on the last one."""
+        response = self.invoke(messages, **kwargs)
+        content = response.content
+        for start in range(0, max(len(content), 1), chunk_size):
+            last = start + chunk_size >= len(content)
+            yield AIMessageChunk(content=content[start:start + chunk_size],
+                                 usage_metadata=response.usage_metadata if last else None,
+                                 response_metadata=response.response_metadata if last else {})
+
+
+def find_divergence(recorded_steps: list, replayed_steps: list, exhausted: bool = False):
+    """
+    Find the first step where a replayed trajectory departs from the recorded one.
+
+    With the LLM outputs fixed, a different parse shows up in `action_input` or `final_answer`
+    and a different execution in `observation`. Later LLM outputs were generated for the
+    recorded observations, so the steps after a divergence are not meaningful.
+
+    Args:
+        recorded_steps (list): Steps of the recorded result.
+        replayed_steps (list): Steps of the replayed result.
+        exhausted (bool): Whether the replayed agent asked for more LLM outputs than were recorded.
+
+    Returns:
+        dict: The index of the step and the differing field, or None if the trajectories match.
+    """
+    for position, (recorded, replayed) in enumerate(zip(recorded_steps, replayed_steps)):
+        for field in ('action_input', 'observation', 'final_answer'):
+            if recorded.get(field) != replayed.get(field):
+                return {"step": position, "field": field}
+    if len(recorded_steps) != len(replayed_steps) or exhausted:
+        return {"step": min(len(recorded_steps), len(replayed_steps)), "field": "steps"}
+    return None
+
+
+class ScriptedJudgeModel:
+    """
+    Offline stand-in of the evaluation judge.
+
+    It answers the prompts of `eval.reproducibility` in the formats the evaluator parses.
+    The workflow is "converted" into the recorded code of the same question, so the second
+    execution costs as much as the first. Every score is 1.
+
+    Args:
+        codes_by_question (dict): Recorded code of each question.
+    """
+    def __init__(self, codes_by_question: dict = None, latency: LatencyModel = None):
+        self.codes_by_question = codes_by_question or {}
+        self.latency = latency
+
+    def _answer(self, system: str, prompt: str) -> str:
+        if 'translating a workflow into code' in system:
+            code = next((code for question, code in self.codes_by_question.items()
+                         if prompt.startswith(f'Question: {question}\n')), "print('No recorded code.')")
+            return f"```python\n{code}\n```"
+        if 'answering a question based on the code' in system:
+            return "Thought:\nThe answer follows from the code output.\n\nConclusion:\nReplayed conclusion."
+        if 'grading the accuracy' in system:
+            return "Thoughts:\nReplayed.\n\nThe accuracy score is: 1"
+        return "Thoughts:\nReplayed.\n\nThe similarity score is: 1"
+
+    def invoke(self, messages, **kwargs):
+        system = next((_message_content(m) for m in messages if (m.type if hasattr(m, 'type') else m[0]) == 'system'), '')
+        prompt = _message_content(messages[-1])
+        if self.latency:
+            time.sleep(self.latency.sample())
+        content = self._answer(system, prompt)
+        return AIMessage(content=content, usage_metadata=_estimate_usage(system + prompt, content))
+
+    async def ainvoke(self, messages, **kwargs):
+        return await asyncio.to_thread(self.invoke, messages, **kwargs)
+
+
+if __name__ == '__main__':
+    pass
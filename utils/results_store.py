@@ -0,0 +1,131 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+
+class ResultsStore:
+    """
+    Append-only JSONL store of per-sample results.
+
+    Every record is one line `{"index": ..., "result": ...}`; a later record of the same index
+    replaces an earlier one. Lines are flushed after every append and fsynced in batches, so a
+    crashed process loses at most the record it was writing and a crashed machine at most one
+    batch. A torn last line is ignored on load and cut off before the next append.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 10):
+        """
+        Args:
+            path (str): Path to the JSONL file.
+            fsync_every (int): Number of appended records between two fsync calls.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self._file = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """
+        Read all complete records.
+
+        Returns:
+            dict: Results keyed by sample index (as a string), as in the JSON results file.
+        """
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write of a crashed run
+                    continue
+                results[str(record['index'])] = record['result']
+        return results
+
+    def _open(self):
+        if self._file is not None:
+            return
+        # Cut off a torn last line so that new records start on a line of their own
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                content = f.read()
+                if content and not content.endswith(b'\n'):
+                    f.truncate(content.rfind(b'\n') + 1)
+        self._file = open(self.path, 'a')
+
+    def append(self, index, result: dict):
+        """Append the result of one sample."""
+        line = json.dumps({"index": str(index), "result": result}) + '\n'
+        with self._lock:
+            self._open()
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    def close(self):
+        """Fsync pending records and close the file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+                self._pending = 0
+
+    def clear(self):
+        """Remove all records."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def compact(self):
+        """Rewrite the file with only the latest record of every index."""
+        self.close()
+        results = self.load()
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for index, result in sort_results(results).items():
+                f.write(json.dumps({"index": index, "result": result}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+def sort_results(results: dict) -> OrderedDict:
+    """Order results by their integer sample index."""
+    return OrderedDict(sorted(results.items(), key=lambda x: int(x[0])))
+
+
+def export_results(results: dict, output_file: str):
+    """
+    Atomically write results in the JSON layout read by the evaluation scripts.
+
+    Args:
+        results (dict): Results keyed by sample index.
+        output_file (str): Path to the `{model}_{dataset}_{agent}.json` file.
+    """
+    temp_path = output_file + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(sort_results(results), f, indent=2)
+    os.replace(temp_path, output_file)
+
+
+if __name__ == '__main__':
+    import click
+
+    @click.command()
+    @click.argument('jsonl_file')
+    def export(jsonl_file):
+        """Compact a JSONL results file and export it to the JSON file next to it."""
+        store = ResultsStore(jsonl_file)
+        store.compact()
+        export_results(store.load(), os.path.splitext(jsonl_file)[0] + '.json')
+
+    export()
@@ -0,0 +1,282 @@
+import os
+import atexit
+import signal
+import multiprocessing
+import queue
+import threading
+import time
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+# How often a waiting parent checks the wall time and memory of a busy worker
+_POLL_INTERVAL = 0.1
+# How long a new worker may take to import the analysis stack before it is replaced
+_READY_TIMEOUT = 300
+
+
+class _CPUTimeExceeded(BaseException):
+    """Raised inside a worker on SIGXCPU; a BaseException so generated code cannot catch it."""
+
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise _CPUTimeExceeded()
+
+
+def _set_cpu_time_limit(cpu_time):
+    """Allow the worker `cpu_time` more seconds of CPU time, or lift the limit when None."""
+    import resource
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = hard
+    if cpu_time:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + cpu_time) + 1
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _rss_mb(pid):
+    """
+    Resident set size in MB of the process group led by `pid`, i.e. a worker and the processes
+    started by its code, or 0 if it cannot be read (non-Linux systems).
+    """
+    page_mb = os.sysconf('SC_PAGE_SIZE') / (1024 * 1024) if hasattr(os, 'sysconf') else 0
+    total = 0
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # Fields after the parenthesized command: state, ppid, pgrp, ..., rss (the 22nd)
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[2]) == pid:
+                total += int(fields[21]) * page_mb
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+def _kill_process_group(process):
+    """Kill a worker and every process started by its code, which share its process group."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        # Not POSIX, or the worker died before starting its own session
+        pass
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+
+def _worker_main(conn, cpu_time=None, dataframe_cache_mb=None, output_capture=None):
+    """
+    Entry point of a sandbox worker process.
+
+    The worker starts its own session, so that the processes started by generated code share its
+    process group and are killed with it. It pre-imports the analysis stack, so executions sent to it
+    do not pay the import cost again, and then sends 'ready' to the parent.
+    """
+    import warnings
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    from utils.code_execution import execute_code, preload_analysis_stack
+    from utils.dataframe_cache import configure_dataframe_cache
+    from utils.output_capture import configure_output_capture
+    warnings.filterwarnings("ignore")
+    preload_analysis_stack()
+    configure_dataframe_cache(dataframe_cache_mb)
+    configure_output_capture(**(output_capture or {}))
+    if cpu_time:
+        signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+    conn.send('ready')
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        query, change_dir = message
+        # The second element tells the parent whether this worker must be replaced
+        try:
+            if cpu_time:
+                _set_cpu_time_limit(cpu_time)
+            response = (execute_code(query, change_dir=change_dir), False)
+        except _CPUTimeExceeded:
+            response = (f"Error [Timeout]: Code execution exceeded the CPU time limit of {cpu_time} seconds.", True)
+        finally:
+            if cpu_time:
+                _set_cpu_time_limit(None)
+        conn.send(response)
+
+
+class _Worker:
+    """A sandbox worker process and the parent end of its pipe."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.num_tasks = 0
+        # Whether the worker has finished importing the analysis stack
+        self.ready = False
+
+
+class SandboxPool:
+    """
+    A pool of pre-warmed worker processes executing generated code.
+
+    Every execution is sent to an idle worker, so several samples can execute code at the
+    same time, and a crashing script only takes down its worker, which is then replaced.
+    Executions exceeding a limit return `Error [Timeout]` or `Error [MemoryLimit]` and the
+    worker that ran them is killed and replaced, together with the processes its code started.
+    """
+
+    def __init__(self, num_workers: int, max_tasks_per_worker: int = 100, cpu_time: float = None,
+                 wall_time: float = None, max_memory_mb: float = None, dataframe_cache_mb: float = None,
+                 output_capture: dict = None):
+        """
+        Start the worker processes.
+
+        Args:
+            num_workers (int): Number of worker processes.
+            max_tasks_per_worker (int): Executions after which a worker is replaced to release
+                memory leaked by generated code. Use 0 to keep workers forever.
+            cpu_time (float): CPU time limit of one execution in seconds.
+            wall_time (float): Wall time limit of one execution in seconds.
+            max_memory_mb (float): Limit on the resident memory of a worker and the processes its
+                code started in MB, including the pre-imported analysis stack. Only enforced on Linux.
+            dataframe_cache_mb (float): Size of the DataFrame cache of each worker in MB
+                (see `utils.dataframe_cache`), or None to disable it.
+            output_capture (dict): Arguments of `utils.output_capture.configure_output_capture`
+                in the workers, or None to capture output without bounds.
+        """
+        self.context = multiprocessing.get_context('spawn')
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.cpu_time = cpu_time
+        self.wall_time = wall_time
+        self.max_memory_mb = max_memory_mb
+        self.dataframe_cache_mb = dataframe_cache_mb
+        self.output_capture = output_capture
+        self.idle_workers = queue.Queue()
+        for _ in range(num_workers):
+            self.idle_workers.put(self._start_worker())
+
+    def _start_worker(self) -> _Worker:
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=_worker_main, args=(child_conn, self.cpu_time, self.dataframe_cache_mb, self.output_capture), daemon=True)
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _stop_worker(self, worker: _Worker, kill: bool = False):
+        if not kill:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.process.join(timeout=5)
+        # Also kills processes the worker's code left running, e.g. joblib workers
+        _kill_process_group(worker.process)
+        worker.conn.close()
+
+    def _wait(self, worker: _Worker):
+        """Wait for the response of a busy worker while enforcing the wall time and memory limits."""
+        if not worker.ready:
+            # A new worker reads the task only after its imports, which are not charged to the task
+            if not worker.conn.poll(_READY_TIMEOUT):
+                return f"Error [WorkerCrashed]: The process executing the code did not start within {_READY_TIMEOUT} seconds.", True
+            worker.conn.recv()
+            worker.ready = True
+        deadline = time.monotonic() + self.wall_time if self.wall_time else None
+        while not worker.conn.poll(_POLL_INTERVAL):
+            if deadline is not None and time.monotonic() > deadline:
+                return f"Error [Timeout]: Code execution exceeded the wall time limit of {self.wall_time} seconds.", True
+            if self.max_memory_mb and _rss_mb(worker.process.pid) > self.max_memory_mb:
+                return f"Error [MemoryLimit]: Code execution exceeded the memory limit of {self.max_memory_mb} MB.", True
+        return worker.conn.recv()
+
+    def run(self, query: str, change_dir: str = None) -> str:
+        """
+        Execute code in one of the workers.
+
+        Args:
+            query (str): Python code to execute.
+            change_dir (str): Directory the worker switches to before executing the code.
+
+        Returns:
+            str: The observation, identical to an in-process `execute_code` call unless a
+                limit was hit or the worker crashed.
+        """
+        worker = self.idle_workers.get()
+        replace = False
+        try:
+            worker.conn.send((query, change_dir))
+            observation, replace = self._wait(worker)
+            worker.num_tasks += 1
+        except (EOFError, OSError):
+            observation = "Error [WorkerCrashed]: The process executing the code exited unexpectedly."
+            replace = True
+        finally:
+            if replace:
+                self._stop_worker(worker, kill=True)
+                worker = self._start_worker()
+            elif self.max_tasks_per_worker and worker.num_tasks >= self.max_tasks_per_worker:
+                self._stop_worker(worker)
+                worker = self._start_worker()
+            self.idle_workers.put(worker)
+        return observation
+
+    def shutdown(self):
+        """Stop all idle workers."""
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            self._stop_worker(worker)
+
+
+def configure_sandbox(num_workers: int, **kwargs):
+    """
+    Route all `CustomPythonAstREPLTool` executions to a pool of worker processes.
+
+    Limits can only be enforced by worker processes, so setting any of `cpu_time`,
+    `wall_time` or `max_memory_mb` starts at least one worker. So does capturing the output
+    of file descriptors (`output_capture['capture_fds']`), which redirects them process-wide.
+
+    Args:
+        num_workers (int): Number of worker processes. Use 0 to execute code in-process.
+        **kwargs: Additional arguments passed to `SandboxPool`.
+    """
+    global _sandbox
+    if any(kwargs.get(limit) for limit in ('cpu_time', 'wall_time', 'max_memory_mb')) \
+            or (kwargs.get('output_capture') or {}).get('capture_fds'):
+        num_workers = max(num_workers, 1)
+    with _sandbox_lock:
+        if _sandbox is not None:
+            _sandbox.shutdown()
+            _sandbox = None
+        if num_workers > 0:
+            _sandbox = SandboxPool(num_workers, **kwargs)
+
+
+def get_sandbox():
+    """Return the configured sandbox pool, or None when code is executed in-process."""
+    return _sandbox
+
+
+def shutdown_sandbox():
+    """Stop the configured sandbox pool, if any."""
+    configure_sandbox(0)
+
+
+atexit.register(shutdown_sandbox)
+
+if __name__ == '__main__':
+    pass
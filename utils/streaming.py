@@ -0,0 +1,128 @@
+import re
+import time
+from langchain_core.messages import AIMessage
+from .rate_limiter import estimate_tokens
+
+# Same pattern as the action input of the output parsers
+_CODE_BLOCK = re.compile(r'```python\s.*?```', re.DOTALL)
+_TASK_DONE = 'Task done'
+
+_early_stop = False
+
+
+def configure_streaming(early_stop: bool):
+    """
+    Enable or disable streaming with early termination in the agents.
+
+    Args:
+        early_stop (bool): Whether agents stream completions and stop them once the output
+            contains the unit they act on.
+    """
+    global _early_stop
+    _early_stop = early_stop
+
+
+def _answer_start(text: str):
+    """
+    Start of the answer in `text`, or None while the model is still thinking.
+
+    DeepSeek-R1 reasons in a `<think>` block that is kept in the content. It often restates the
+    instructions there (e.g. to end with 'Task done!'), so the stop conditions only apply after
+    `</think>`.
+    """
+    if '<think>' not in text:
+        return 0
+    close = text.find('</think>')
+    return None if close == -1 else close + len('</think>')
+
+
+def code_block_end(text: str):
+    """End of the first closed ```python block of the answer in `text`, or None."""
+    start = _answer_start(text)
+    if start is None:
+        return None
+    match = _CODE_BLOCK.search(text, start)
+    return match.end() if match else None
+
+
+def action_or_task_done_end(text: str):
+    """
+    End of the first closed ```python block or 'Task done' marker of the answer in `text`, or None.
+
+    A 'Task done' inside a code block, e.g. `print('Task done')`, is not the marker. Only text
+    before the first ```python fence is searched, as the stream stops at the end of that block.
+    """
+    start = _answer_start(text)
+    if start is None:
+        return None
+    end = code_block_end(text)
+    fence = text.find('```python', start)
+    position = text.find(_TASK_DONE, start, fence if fence != -1 else len(text))
+    if position != -1:
+        return position + len(_TASK_DONE)
+    return end
+
+
+def _estimate_usage(messages, content: str) -> dict:
+    input_tokens, output_tokens = estimate_tokens(messages), len(content) // 4 + 1
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+
+def stream_until(llm, messages, stop_at=None):
+    """
+    Stream a completion and stop it as soon as `stop_at` finds the end of an actionable unit.
+
+    Closing the stream closes the connection, which makes the provider stop generating. The
+    content is cut at the position returned by `stop_at`, so it does not depend on how the
+    completion was chunked. Stopped streams (and providers that do not report usage while
+    streaming) get an `usage_metadata` estimated at four characters per token.
+
+    Args:
+        llm: The chat model.
+        messages (list): The prompt messages.
+        stop_at (callable): Returns the end position of the unit in the text so far, or None.
+
+    Returns:
+        tuple: The response message and the seconds until the first chunk.
+    """
+    start = time.perf_counter()
+    ttft, merged, end = None, None, None
+    stream = llm.stream(messages)
+    try:
+        for chunk in stream:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            merged = chunk if merged is None else merged + chunk
+            end = stop_at(merged.content) if stop_at else None
+            if end is not None:
+                break
+    finally:
+        stream.close()
+
+    content = '' if merged is None else merged.content
+    response_metadata = {} if merged is None else dict(merged.response_metadata)
+    usage_metadata = None if merged is None else merged.usage_metadata
+    if end is not None:
+        content = content[:end]
+        response_metadata['stopped_early'] = True
+        usage_metadata = None
+    if not usage_metadata:
+        usage_metadata = _estimate_usage(messages, content)
+        response_metadata['usage_estimated'] = True
+    return AIMessage(content=content, usage_metadata=usage_metadata, response_metadata=response_metadata), ttft
+
+
+def call_llm(llm, messages, stop_at=None):
+    """
+    Invoke `llm`, streaming with early termination if it is enabled and `stop_at` is given.
+
+    Returns:
+        tuple: The response message and the seconds until the first chunk (None if not streamed).
+    """
+    if _early_stop and stop_at is not None:
+        return stream_until(llm, messages, stop_at)
+    return llm.invoke(messages), None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Index of the sample whose spans the current thread or task records
+_sample = contextvars.ContextVar('trace_sample', default=None)
+
+_tracer = None
+
+
+class Tracer:
+    """
+    Spans of a run in the Chrome trace event format, viewable in Perfetto or chrome://tracing.
+
+    Every sample is shown as a process (pid = index + 1, pid 0 for spans outside samples)
+    and every thread that worked on it as one of its threads, so the spans of concurrent
+    samples and of the parallel stages of one sample do not overlap on a track.
+
+    Args:
+        events (list): Complete ('X') events with timestamps in microseconds.
+    """
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start_ns: int, end_ns: int, args: dict):
+        sample = _sample.get()
+        pid = 0 if sample is None else sample + 1
+        tid = threading.get_native_id()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start_ns - self.origin) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            if (pid, tid) not in self._names:
+                self._names[(pid, tid)] = threading.current_thread().name
+                if (pid, None) not in self._names:
+                    self._names[(pid, None)] = 'run' if sample is None else f'sample {sample}'
+
+    def export(self, path: str):
+        """Write the trace to `path` atomically."""
+        with self._lock:
+            metadata = [
+                {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}} if tid is None
+                else {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for (pid, tid), name in self._names.items()
+            ]
+            trace = {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(trace, f, default=str)
+        os.replace(tmp_path, path)
+
+
+_trace_path = None
+
+
+def configure_tracing(path: str):
+    """
+    Record spans and export them to `path` when the run finishes.
+
+    Args:
+        path (str): Path to the trace JSON file, or None to disable tracing. A relative path is
+            resolved now, as generated code may change the working directory before the export.
+    """
+    global _tracer, _trace_path
+    _tracer = Tracer() if path else None
+    _trace_path = os.path.abspath(path) if path else None
+
+
+def finish_tracing():
+    """Export the recorded spans."""
+    if _tracer is not None and _trace_path:
+        _tracer.export(_trace_path)
+
+
+@contextmanager
+def trace_sample(index: int):
+    """Attribute the spans recorded in the enclosed block to the sample `index`."""
+    token = _sample.set(index)
+    try:
+        yield
+    finally:
+        _sample.reset(token)
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Record the enclosed block as a span of the current sample.
+
+    The yielded dictionary holds the arguments of the span, e.g. token counts. Its `outcome`
+    is 'ok', or the type of the exception that left the block.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    start_ns = time.perf_counter_ns()
+    try:
+        yield args
+    except BaseException as error:
+        args.setdefault('outcome', f'error: {type(error).__name__}')
+        raise
+    finally:
+        args.setdefault('outcome', 'ok')
+        tracer.add(name, start_ns, time.perf_counter_ns(), args)
+
+
+def traced(name: str):
+    """Decorator recording every call of the function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if __name__ == '__main__':
+    pass